@@ -0,0 +1,193 @@
+"""
+Local mock of the NetBox REST API serving a SyntheticNetBox inventory.
+
+Supports limit/offset pagination capped at a MAX_PAGE_SIZE (1000, like NetBox), the filters
+main.py sends (id, role, status, tenant_id, device_id, site_id, last_updated__gte), brief=1 and fields=,
+and an artificial latency per request plus per returned object. Objects are encoded once at
+startup and pages are joined from the encoded bytes.
+
+Standalone use, e.g. to run main.py by hand against 10k devices:
+
+    python benchmarks/mock_netbox.py --devices 10000 --port 8000
+    NETBOX_URL=http://127.0.0.1:8000/api/ python main.py
+"""
+import argparse
+import json
+import threading
+import time
+from collections import OrderedDict, defaultdict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit, parse_qs, urlencode
+
+from synthetic import SyntheticNetBox
+
+MAX_PAGE_SIZE = 1000
+# Keys kept by brief=1 (NetBox's brief serializers keep a few identifying fields per model)
+BRIEF_KEYS = ('id', 'url', 'display', 'name', 'slug', 'cid', 'address', 'family', 'circuit', 'term_side', 'description')
+# Query parameters that are not filters
+PAGING_KEYS = {'limit', 'offset', 'brief', 'fields', 'ordering'}
+
+def termination_devices(cable):
+    return {term['object']['device']['id'] for side in ('a_terminations', 'b_terminations')
+            for term in cable[side] if term['object_type'] == 'dcim.interface'}
+
+def object_sites(obj):
+    if 'termination_a' in obj:
+        return {term['site']['id'] for term in (obj['termination_a'], obj['termination_z']) if term.get('site')}
+    return {obj['site']['id']} if obj.get('site') else set()
+
+class Listing:
+    """Encoded objects of one endpoint, with inverted indexes for the supported filters."""
+
+    def __init__(self, objects):
+        self.encoded, self.last_updated = [], []
+        self.by_id, self.by_device, self.by_site = {}, defaultdict(list), defaultdict(list)
+        self.by_value = defaultdict(lambda: defaultdict(list))
+        for obj in objects:
+            self._append(obj)
+        self._cache, self._lock = OrderedDict(), threading.Lock()
+
+    def _append(self, obj):
+        index = len(self.encoded)
+        self.encoded.append(json.dumps(obj, separators=(',', ':')).encode())
+        self.last_updated.append(obj.get('last_updated') or '')
+        self.by_id[obj['id']] = index
+        if 'a_terminations' in obj:
+            for device_id in termination_devices(obj): self.by_device[device_id].append(index)
+        for site_id in object_sites(obj): self.by_site[site_id].append(index)
+        if isinstance(obj.get('role'), dict): self.by_value['role'][obj['role']['slug']].append(index)
+        if isinstance(obj.get('status'), dict): self.by_value['status'][obj['status']['value']].append(index)
+        if 'tenant' in obj: self.by_value['tenant_id'][str(obj['tenant']['id']) if obj['tenant'] else 'null'].append(index)
+
+    def get(self, obj_id):
+        return json.loads(self.encoded[self.by_id[obj_id]])
+
+    def put(self, obj):
+        """
+        Replaces the object with the same id (or adds it). Only fields that are not filtered on
+        may change for an existing object, since the indexes are not rebuilt.
+        """
+        with self._lock:
+            if obj['id'] in self.by_id:
+                index = self.by_id[obj['id']]
+                self.encoded[index] = json.dumps(obj, separators=(',', ':')).encode()
+                self.last_updated[index] = obj.get('last_updated') or ''
+            else:
+                self._append(obj)
+            self._cache.clear()
+
+    def select(self, filters):
+        """Indexes of the objects matching every filter (values of one filter are OR-ed, like NetBox)."""
+        key = tuple(sorted((name, tuple(values)) for name, values in filters.items()))
+        with self._lock:
+            if key in self._cache:
+                self._cache.move_to_end(key)
+                return self._cache[key]
+        selected = None
+        for name, values in filters.items():
+            if name == 'id': matches = {self.by_id[int(v)] for v in values if v.isdigit() and int(v) in self.by_id}
+            elif name == 'device_id': matches = {i for v in values if v.isdigit() for i in self.by_device.get(int(v), ())}
+            elif name == 'site_id': matches = {i for v in values if v.isdigit() for i in self.by_site.get(int(v), ())}
+            elif name in self.by_value: matches = {i for v in values for i in self.by_value[name].get(v, ())}
+            elif name == 'last_updated__gte': matches = {i for i, stamp in enumerate(self.last_updated) if stamp >= values[0]}
+            else: continue  # NetBox ignores unknown query parameters
+            selected = matches if selected is None else selected & matches
+        selected = range(len(self.encoded)) if selected is None else sorted(selected)
+        with self._lock:
+            self._cache[key] = selected
+            if len(self._cache) > 512: self._cache.popitem(last=False)
+        return selected
+
+class MockNetBox:
+    """Serves `inventory` (a SyntheticNetBox) on http://host:port/api/ from a background thread."""
+
+    def __init__(self, inventory, host='127.0.0.1', port=0, latency=0.02, per_object_latency=0.00002, max_page_size=MAX_PAGE_SIZE):
+        self.listings = {'/api/' + path: Listing(objects()) for path, objects in inventory.endpoints().items()}
+        self.latency, self.per_object_latency, self.max_page_size = latency, per_object_latency, max_page_size
+        self.requests = 0
+        self.server = ThreadingHTTPServer((host, port), self._handler())
+        self.server.daemon_threads = True
+        self._thread = None
+
+    @property
+    def url(self):
+        host, port = self.server.server_address[:2]
+        return f"http://{host}:{port}/api/"
+
+    def start(self):
+        self._thread = threading.Thread(target=self.server.serve_forever, name='mock-netbox', daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def page(self, path, params, host):
+        listing = self.listings[path]
+        filters = {name: values for name, values in params.items() if name not in PAGING_KEYS}
+        selected = listing.select(filters)
+        limit = int(params.get('limit', ['50'])[0] or 0)
+        limit = self.max_page_size if limit <= 0 else min(limit, self.max_page_size)
+        offset = int(params.get('offset', ['0'])[0] or 0)
+        items = [listing.encoded[i] for i in selected[offset:offset + limit]]
+        keys = BRIEF_KEYS if params.get('brief', [''])[0] in ('1', 'true', 'True') else None
+        if params.get('fields'):
+            keys = tuple(params['fields'][0].split(','))
+        if keys:
+            items = [json.dumps({k: v for k, v in json.loads(item).items() if k in keys}, separators=(',', ':')).encode() for item in items]
+
+        def link(new_offset):
+            query = dict(params, limit=[str(limit)], offset=[str(new_offset)])
+            return json.dumps(f"http://{host}{path}?{urlencode(query, doseq=True)}").encode()
+        next_link = link(offset + limit) if offset + limit < len(selected) else b'null'
+        previous_link = link(max(offset - limit, 0)) if offset > 0 else b'null'
+        time.sleep(self.latency + self.per_object_latency * len(items))
+        return b''.join((b'{"count":', str(len(selected)).encode(), b',"next":', next_link, b',"previous":', previous_link,
+                         b',"results":[', b','.join(items), b']}'))
+
+    def _handler(self):
+        mock = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def log_message(self, format, *args):
+                pass
+
+            def do_GET(self):
+                mock.requests += 1
+                parts = urlsplit(self.path)
+                if parts.path not in mock.listings:
+                    body, status = b'{"detail":"Not found."}', 404
+                else:
+                    body, status = mock.page(parts.path, parse_qs(parts.query), self.headers.get('Host', '')), 200
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+        return Handler
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve a synthetic NetBox inventory over a mock REST API.")
+    parser.add_argument('--devices', type=int, default=1000)
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8000)
+    parser.add_argument('--latency', type=float, default=0.02, help="seconds added to every response")
+    parser.add_argument('--per-object-latency', type=float, default=0.00002, help="seconds added per returned object")
+    args = parser.parse_args()
+    print(f"Generating {args.devices} devices...")
+    mock = MockNetBox(SyntheticNetBox(args.devices, seed=args.seed), args.host, args.port, args.latency, args.per_object_latency)
+    print(f"Serving mock NetBox on {mock.url}")
+    try:
+        mock.server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        mock.server.server_close()
+
+if __name__ == '__main__':
+    main()
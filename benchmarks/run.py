@@ -0,0 +1,254 @@
+"""
+Timed benchmark scenarios for main.py, against the mock NetBox and the stub geocoder.
+
+A scenario is a device count, an aggregation level, an anonymization mode and a collection
+mode. Each scenario runs main.main() in a fresh interpreter, so caches and memory peaks are
+its own, and reads the stage timings from its run report (REPORT_FILE):
+
+- fetch: the 'collection' stage
+- processing: 'locations', 'node_pass' and 'link_pass'
+- serialization: 'serialization'
+
+Results go to benchmarks/results/<UTC time>.json. --baseline compares them with an earlier
+results file and exits with status 1 when a stage got slower than --tolerance allows.
+
+    python benchmarks/run.py                                # 1k, 10k and 100k devices, every mode
+    python benchmarks/run.py --sizes 1000,10000 --aggregations tenant --baseline benchmarks/results/<earlier>.json
+"""
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+from itertools import product
+
+BENCHMARK_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_ROOT = os.path.dirname(BENCHMARK_DIR)
+RESULTS_DIR = os.path.join(BENCHMARK_DIR, 'results')
+
+AGGREGATIONS = {
+    'device': {'AGGREGATE_BY': 'device'},
+    'tenant': {'AGGREGATE_BY': 'tenant'},
+    'site': {'AGGREGATE_BY': 'site'},
+}
+ANONYMIZATIONS = {
+    'none': {'ANONYMIZE_LOCATION': False, 'ANONYMIZE_FIELDS': False, 'ANONYMIZE_INTERFACES': False, 'ANONYMIZE_IPS': False},
+    'sequential': {'ANONYMIZE_LOCATION': True, 'ANONYMIZE_FIELDS': True, 'ANONYMIZE_INTERFACES': True, 'ANONYMIZE_IPS': True,
+                   'ANONYMIZATION_MODE': 'sequential'},
+    'keyed': {'ANONYMIZE_LOCATION': True, 'ANONYMIZE_FIELDS': True, 'ANONYMIZE_INTERFACES': True, 'ANONYMIZE_IPS': True,
+              'ANONYMIZATION_MODE': 'keyed', 'ANONYMIZATION_KEY': 'benchmark-key'},
+}
+COLLECTIONS = {
+    'full': {'TARGETED_COLLECTION': False},
+    'targeted': {'TARGETED_COLLECTION': True},
+}
+# Flags that would make runs depend on earlier runs or on anything but the mock server
+ISOLATION_FLAGS = {
+    'GEOCODE_CACHE_FILE': None, 'FETCH_CHECKPOINT_DIR': None, 'INCREMENTAL_SYNC': False, 'SNAPSHOT_MODE': None,
+    'VARIANTS': None, 'SERVICE_MODE': False, 'GAZETTEER_FILE': None, 'REPORT_PROMETHEUS_FILE': None,
+}
+PROCESSING_STAGES = ('locations', 'node_pass', 'link_pass')
+# Compared against the baseline, with the smallest change worth reporting
+COMPARED_METRICS = {'wall_seconds': 0.05, 'fetch_seconds': 0.05, 'processing_seconds': 0.05, 'serialization_seconds': 0.05,
+                    'peak_rss_bytes': 16 * 2 ** 20}
+
+# --- Worker (one scenario, in its own interpreter) ---
+
+def run_worker(spec_path):
+    with open(spec_path, encoding='utf-8') as f:
+        spec = json.load(f)
+    sys.path.insert(0, REPO_ROOT)
+    import main
+    from geocoder import StubGeocoder
+
+    for name, value in spec['flags'].items():
+        if not hasattr(main, name):
+            sys.exit(f"Unknown main.py flag: {name}")
+        setattr(main, name, value)
+    main.baseUrl = spec['url']
+    main._geolocator = geocoder = StubGeocoder(spec['geocode_delay'])
+    started = time.perf_counter()
+    main.main()
+    wall_seconds = time.perf_counter() - started
+
+    with open(main.REPORT_FILE, encoding='utf-8') as f:
+        report = json.load(f)
+    stages = {name: stage['seconds'] for name, stage in report['stages'].items()}
+    result = {
+        'success': report['success'],
+        'wall_seconds': wall_seconds,
+        'fetch_seconds': stages.get('collection', 0.0),
+        'processing_seconds': sum(stages.get(name, 0.0) for name in PROCESSING_STAGES),
+        'serialization_seconds': stages.get('serialization', 0.0),
+        'stages': stages,
+        'peak_rss_bytes': report['peak_rss_bytes'],
+        'http_requests': report['http']['requests'],
+        'http_bytes': report['http']['bytes_received'],
+        'geocoder_calls': geocoder.calls,
+        'objects': report['objects'],
+        'output_bytes': os.path.getsize(main.OUTPUT_FILE),
+    }
+    with open(spec['result'], 'w', encoding='utf-8') as f:
+        json.dump(result, f)
+
+# --- Runner ---
+
+def run_scenario(url, flags, args):
+    """Runs one scenario `args.repeat` times and keeps the run with the median wall time."""
+    runs = []
+    for _ in range(args.repeat):
+        with tempfile.TemporaryDirectory(prefix='grenml-bench-') as work_dir:
+            spec = {
+                'url': url, 'geocode_delay': args.geocode_delay, 'result': os.path.join(work_dir, 'result.json'),
+                'flags': dict(flags, OUTPUT_FILE=os.path.join(work_dir, 'grenml.xml'), REPORT_FILE=os.path.join(work_dir, 'run_report.json')),
+            }
+            spec_path = os.path.join(work_dir, 'spec.json')
+            with open(spec_path, 'w', encoding='utf-8') as f:
+                json.dump(spec, f)
+            log_path = os.path.join(work_dir, 'main.log')
+            with open(log_path, 'w', encoding='utf-8') as log:
+                process = subprocess.run([sys.executable, os.path.abspath(__file__), '--worker', spec_path],
+                                         cwd=work_dir, stdout=log, stderr=subprocess.STDOUT, timeout=args.timeout)
+            if process.returncode != 0 or not os.path.exists(spec['result']):
+                with open(log_path, encoding='utf-8', errors='replace') as log:
+                    tail = log.read()[-2000:]
+                return {'success': False, 'error': f"exit status {process.returncode}", 'log_tail': tail}
+            with open(spec['result'], encoding='utf-8') as f:
+                runs.append(json.load(f))
+    runs.sort(key=lambda run: run['wall_seconds'])
+    result = runs[len(runs) // 2]
+    if len(runs) > 1:
+        result['wall_seconds_runs'] = [run['wall_seconds'] for run in runs]
+    return result
+
+def scenario_key(scenario):
+    return (scenario['devices'], scenario['aggregation'], scenario['anonymization'], scenario['collection'])
+
+def scenario_label(scenario):
+    return f"{scenario['devices']:>7} {scenario['aggregation']:<7} {scenario['anonymization']:<10} {scenario['collection']:<8}"
+
+def format_result(scenario, result):
+    label = scenario_label(scenario)
+    if not result.get('success'):
+        return f"{label} FAILED ({result.get('error', 'unsuccessful run')})"
+    return (f"{label} wall {result['wall_seconds']:8.2f}s  fetch {result['fetch_seconds']:7.2f}s  "
+            f"processing {result['processing_seconds']:7.2f}s  serialization {result['serialization_seconds']:6.2f}s  "
+            f"rss {(result['peak_rss_bytes'] or 0) / 2 ** 20:7.1f} MiB  {result['http_requests']} requests")
+
+def compare(results, baseline, tolerance):
+    """Lines describing every compared metric that grew by more than `tolerance` (a fraction) over the baseline."""
+    previous = {scenario_key(entry['scenario']): entry['result'] for entry in baseline['results']}
+    regressions = []
+    for entry in results:
+        old, new = previous.get(scenario_key(entry['scenario'])), entry['result']
+        if not old or not old.get('success') or not new.get('success'):
+            continue
+        for metric, min_delta in COMPARED_METRICS.items():
+            if old.get(metric) is None or new.get(metric) is None:
+                continue
+            if new[metric] > old[metric] * (1 + tolerance) and new[metric] - old[metric] > min_delta:
+                regressions.append(f"{scenario_label(entry['scenario']).strip()}: {metric} "
+                                   f"{old[metric]:.6g} -> {new[metric]:.6g} (+{(new[metric] / old[metric] - 1) * 100:.0f}%)")
+    return regressions
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=REPO_ROOT, capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def parse_list(value, choices=None):
+    items = [item.strip() for item in value.split(',') if item.strip()]
+    for item in items:
+        if choices is not None and item not in choices:
+            raise argparse.ArgumentTypeError(f"'{item}' is not one of {', '.join(choices)}")
+    return items
+
+def parse_flag(assignment):
+    name, _, value = assignment.partition('=')
+    try:
+        return name, json.loads(value)
+    except ValueError:
+        return name, value
+
+def main():
+    parser = argparse.ArgumentParser(description="Run timed main.py scenarios against a mock NetBox.")
+    parser.add_argument('--sizes', type=lambda v: [int(size) for size in parse_list(v)], default=[1000, 10000, 100000], help="device counts (default: 1000,10000,100000)")
+    parser.add_argument('--aggregations', type=lambda v: parse_list(v, AGGREGATIONS), default=list(AGGREGATIONS))
+    parser.add_argument('--anonymization', type=lambda v: parse_list(v, ANONYMIZATIONS), default=list(ANONYMIZATIONS))
+    parser.add_argument('--collections', type=lambda v: parse_list(v, COLLECTIONS), default=['full'])
+    parser.add_argument('--set', type=parse_flag, action='append', default=[], metavar='FLAG=VALUE', help="extra main.py flag for every scenario (JSON value)")
+    parser.add_argument('--repeat', type=int, default=1, help="runs per scenario; the median wall time is kept")
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--latency', type=float, default=0.02, help="mock NetBox seconds per response")
+    parser.add_argument('--per-object-latency', type=float, default=0.00002, help="mock NetBox seconds per returned object")
+    parser.add_argument('--geocode-delay', type=float, default=0.0, help="stub geocoder seconds per lookup")
+    parser.add_argument('--timeout', type=float, default=3600, help="seconds before a scenario run is killed")
+    parser.add_argument('--output', help="results file (default: benchmarks/results/<UTC time>.json)")
+    parser.add_argument('--baseline', help="earlier results file to compare with")
+    parser.add_argument('--tolerance', type=float, default=0.2, help="allowed growth over the baseline (default: 0.2 = 20%%)")
+    parser.add_argument('--worker', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.worker:
+        run_worker(args.worker)
+        return
+
+    from mock_netbox import MockNetBox
+    from synthetic import SyntheticNetBox
+
+    output = args.output or os.path.join(RESULTS_DIR, datetime.now(timezone.utc).strftime('%Y%m%dT%H%M%SZ') + '.json')
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    document = {
+        'created_at': datetime.now(timezone.utc).strftime('%Y-%m-%dT%H:%M:%SZ'),
+        'commit': git_commit(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpus': os.cpu_count(),
+        'settings': {'seed': args.seed, 'latency': args.latency, 'per_object_latency': args.per_object_latency,
+                     'geocode_delay': args.geocode_delay, 'repeat': args.repeat, 'flags': dict(args.set)},
+        'results': [],
+    }
+    failed = False
+    for size in args.sizes:
+        print(f"Generating a synthetic NetBox with {size} devices...")
+        started = time.perf_counter()
+        mock = MockNetBox(SyntheticNetBox(size, seed=args.seed), latency=args.latency, per_object_latency=args.per_object_latency).start()
+        print(f"Mock NetBox ready on {mock.url} in {time.perf_counter() - started:.1f}s")
+        try:
+            for aggregation, anonymization, collection in product(args.aggregations, args.anonymization, args.collections):
+                scenario = {'devices': size, 'aggregation': aggregation, 'anonymization': anonymization, 'collection': collection}
+                flags = dict(ISOLATION_FLAGS, **AGGREGATIONS[aggregation], **ANONYMIZATIONS[anonymization], **COLLECTIONS[collection], **dict(args.set))
+                result = run_scenario(mock.url, flags, args)
+                failed = failed or not result.get('success')
+                print(format_result(scenario, result))
+                if 'log_tail' in result:
+                    print(result['log_tail'])
+                document['results'].append({'scenario': scenario, 'result': result})
+                # Rewritten after every scenario, so an interrupted suite keeps what it measured
+                with open(output + '.tmp', 'w', encoding='utf-8') as f:
+                    json.dump(document, f, indent=2)
+                os.replace(output + '.tmp', output)
+        finally:
+            mock.stop()
+    print(f"Results saved to '{output}'.")
+
+    if args.baseline:
+        with open(args.baseline, encoding='utf-8') as f:
+            baseline = json.load(f)
+        if baseline.get('settings') != document['settings']:
+            print("WARNING: The baseline was recorded with different settings.")
+        regressions = compare(document['results'], baseline, args.tolerance)
+        for line in regressions:
+            print(f"REGRESSION {line}")
+        if regressions:
+            sys.exit(1)
+        print(f"No regressions beyond {args.tolerance:.0%} against '{args.baseline}'.")
+    if failed:
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
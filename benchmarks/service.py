@@ -0,0 +1,147 @@
+"""
+End-to-end check of SERVICE_MODE against the mock NetBox and the stub geocoder.
+
+Starts the service in this process and times the first build. It checks conditional GETs,
+then renames a node device in the mock and sends a signed NetBox webhook for it (plus one
+with a bad signature). It then times the debounced rebuild until the served ETag changes.
+The stub geocoder is down during the first build, so the check also makes sure that outage
+does not stick: after the rebuild every node must have anonymized (cell center) coordinates.
+
+    python benchmarks/service.py --devices 300
+
+Exits with status 1 when a check fails.
+"""
+import argparse
+import hashlib
+import hmac
+import json
+import os
+import re
+import socket
+import sys
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.request
+
+from geocoder import StubGeocoder
+from mock_netbox import MockNetBox
+from run import ISOLATION_FLAGS, REPO_ROOT
+from synthetic import SyntheticNetBox
+
+WEBHOOK_SECRET = 'benchmark-secret'
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+def request(url, method='GET', body=None, headers=None):
+    """(status, headers, body) of an HTTP request, without raising on 3xx/4xx/5xx."""
+    req = urllib.request.Request(url, data=body, method=method, headers=headers or {})
+    try:
+        with urllib.request.urlopen(req, timeout=30) as response:
+            return response.status, response.headers, response.read()
+    except urllib.error.HTTPError as e:
+        return e.code, e.headers, e.read()
+
+def wait_for(condition, timeout):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        result = condition()
+        if result:
+            return result
+        time.sleep(0.05)
+    return None
+
+def anonymized(body):
+    """True when every node latitude and longitude is a stub geocoder cell center (x.5) or absent (0)."""
+    values = [float(value) for value in re.findall(rb'<grenml:(?:lat|long)>([-0-9.]+)<', body)]
+    return bool(values) and all(value == 0 or value % 1 == 0.5 for value in values)
+
+def main():
+    parser = argparse.ArgumentParser(description="Check SERVICE_MODE end to end against a mock NetBox.")
+    parser.add_argument('--devices', type=int, default=300)
+    parser.add_argument('--timeout', type=float, default=300, help="seconds to wait for each build")
+    args = parser.parse_args()
+
+    inventory = SyntheticNetBox(args.devices)
+    mock = MockNetBox(inventory, latency=0, per_object_latency=0).start()
+    sys.path.insert(0, REPO_ROOT)
+    import main as converter
+
+    work_dir = tempfile.mkdtemp(prefix='grenml-service-')
+    port = free_port()
+    flags = dict(ISOLATION_FLAGS, SERVICE_MODE=True, SERVICE_HOST='127.0.0.1', SERVICE_PORT=port, SERVICE_DEBOUNCE=0.2,
+                 SERVICE_DEBOUNCE_MAX=2, SERVICE_WEBHOOK_SECRET=WEBHOOK_SECRET, AGGREGATE_BY='device', ANONYMIZE_LOCATION=True,
+                 OUTPUT_FILE=os.path.join(work_dir, 'grenml.xml'), REPORT_FILE=os.path.join(work_dir, 'run_report.json'))
+    for name, value in flags.items():
+        setattr(converter, name, value)
+    converter.baseUrl = mock.url
+    converter._geolocator = geocoder = StubGeocoder()
+    geocoder.failing = True
+
+    service_url = f"http://127.0.0.1:{port}/"
+    failures = []
+
+    def check(name, ok, detail=''):
+        print(f"{'ok    ' if ok else 'FAILED'} {name}{f' ({detail})' if detail else ''}")
+        if not ok:
+            failures.append(name)
+
+    started = time.monotonic()
+    threading.Thread(target=converter.main, name='grenml-service', daemon=True).start()
+
+    def ready():
+        try:
+            return json.loads(request(service_url + 'healthz')[2]).get('ready')
+        except (OSError, ValueError):
+            return None
+    check('first build', wait_for(ready, args.timeout), f"{time.monotonic() - started:.2f}s")
+    if failures:
+        sys.exit(1)
+    geocoder.failing = False
+
+    status, headers, body = request(service_url)
+    etag = headers.get('ETag')
+    check('GET / serves the output', status == 200 and etag and b'<grenml:Topology' in body, f"{len(body)} bytes, ETag {etag}")
+    check('GET with a matching If-None-Match is 304', request(service_url, headers={'If-None-Match': etag})[0] == 304)
+    head = request(service_url, method='HEAD')
+    check('HEAD has no body', head[0] == 200 and head[2] == b'')
+
+    device_id = next(i + 1 for i in range(args.devices) if inventory.device_node[i] and inventory.device_status[i] == 0)
+    listing = mock.listings['/api/dcim/devices/']
+    device = listing.get(device_id)
+    new_name = f"renamed-{device_id}"
+    listing.put(dict(device, name=new_name, display=new_name))
+    payload = json.dumps({'event': 'updated', 'model': 'device', 'data': {'id': device_id, 'name': new_name}}).encode()
+    signature = hmac.new(WEBHOOK_SECRET.encode(), payload, hashlib.sha512).hexdigest()
+
+    status = request(service_url + 'webhook', 'POST', payload, {'Content-Type': 'application/json', 'X-Hook-Signature': '0' * 128})[0]
+    check('webhook with a bad signature is 403', status == 403)
+    sent = time.monotonic()
+    status = request(service_url + 'webhook', 'POST', payload, {'Content-Type': 'application/json', 'X-Hook-Signature': signature})[0]
+    check('signed webhook is 202', status == 202)
+
+    def rebuilt():
+        status, headers, body = request(service_url)
+        return (headers.get('ETag'), body) if status == 200 and headers.get('ETag') != etag else None
+    result = wait_for(rebuilt, args.timeout)
+    check('rebuild after the webhook changes the ETag', result, f"{time.monotonic() - sent:.2f}s after the webhook")
+    if result:
+        new_etag, new_body = result
+        check('rebuilt output has the renamed device', new_name.encode() in new_body)
+        check('geocoding outage of the first build is not cached', anonymized(new_body))
+        check('old ETag now gets 200', request(service_url, headers={'If-None-Match': etag})[0] == 200)
+        check('new ETag gets 304', request(service_url, headers={'If-None-Match': new_etag})[0] == 304)
+    health = json.loads(request(service_url + 'healthz')[2])
+    check('healthz reports the build', health['last_build']['success'] and health['pending'] == 0, json.dumps(health))
+
+    mock.stop()
+    if failures:
+        sys.exit(1)
+    print("All service checks passed.")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,180 @@
+"""
+Synthetic NetBox inventory for the benchmarks.
+
+Objects are shaped like the NetBox 4.x REST API (nested brief representations,
+status dicts, cable terminations) and generated lazily per endpoint, so large
+inventories only live in memory once, as the mock server's encoded pages.
+The same arguments and seed always give the same inventory.
+"""
+import random
+
+STAMP = '2024-01-01T00:00:00.000000Z'
+NODE_ROLE = {'id': 1, 'url': '/api/dcim/device-roles/1/', 'display': 'GP4L Node', 'name': 'GP4L Node', 'slug': 'gp4l-node'}
+OTHER_ROLE = {'id': 2, 'url': '/api/dcim/device-roles/2/', 'display': 'Access Switch', 'name': 'Access Switch', 'slug': 'access-switch'}
+DEVICE_TYPE = {'id': 1, 'url': '/api/dcim/device-types/1/', 'display': 'MX204', 'manufacturer': {'id': 1, 'url': '/api/dcim/manufacturers/1/', 'display': 'Juniper', 'name': 'Juniper', 'slug': 'juniper'}, 'model': 'MX204', 'slug': 'mx204'}
+PROVIDER = {'id': 1, 'url': '/api/circuits/providers/1/', 'display': 'Carrier', 'name': 'Carrier', 'slug': 'carrier'}
+STATUSES = (('active', 'Active'), ('offline', 'Offline'), ('planned', 'Planned'))
+
+def brief(kind, obj_id, name, **extra):
+    return dict({'id': obj_id, 'url': f'/api/{kind}/{obj_id}/', 'display': name, 'name': name}, **extra)
+
+class SyntheticNetBox:
+    """
+    An inventory of `devices` devices spread over `sites` sites and `tenants` tenants, joined by
+    `links_per_device * devices` links. A `circuit_share` of the links are circuits; a
+    `cabled_circuit_share` of those are cabled to devices on both ends (resolved through cables),
+    the others only tie two sites together. `node_share` of the devices have the node role, and a
+    `unlocated_site_share` of the sites have an address but no coordinates (forward geocoding).
+    """
+
+    def __init__(self, devices=1000, sites=None, tenants=None, links_per_device=1.0, circuit_share=0.1,
+                 cabled_circuit_share=0.5, node_share=0.8, unlocated_site_share=0.1, seed=1):
+        self.device_count = devices
+        self.site_count = sites or max(1, devices // 20)
+        self.tenant_count = tenants or max(1, devices // 100)
+        self.unlocated_site_share = unlocated_site_share
+        self.seed = seed
+        rng = random.Random(seed)
+        # Compact per-device attributes: site, tenant (0 for none), node role, status index
+        self.device_site = [rng.randrange(1, self.site_count + 1) for _ in range(devices)]
+        self.device_tenant = [rng.randrange(1, self.tenant_count + 1) if rng.random() < 0.9 else 0 for _ in range(devices)]
+        self.device_node = [rng.random() < node_share for _ in range(devices)]
+        self.device_status = [0 if rng.random() < 0.95 else rng.randrange(1, len(STATUSES)) for _ in range(devices)]
+        # Links as (kind, device a, device b): 'cable', 'cabled_circuit' or 'circuit'
+        self.links = []
+        for _ in range(int(devices * links_per_device)):
+            a, b = rng.randrange(1, devices + 1), rng.randrange(1, devices + 1)
+            kind = 'cable'
+            if rng.random() < circuit_share:
+                kind = 'cabled_circuit' if rng.random() < cabled_circuit_share else 'circuit'
+            self.links.append((kind, a, b))
+
+    def site_ref(self, site_id):
+        return brief('dcim/sites', site_id, f'Site {site_id}', slug=f'site-{site_id}', description='')
+
+    def tenant_ref(self, tenant_id):
+        return brief('tenancy/tenants', tenant_id, f'Tenant {tenant_id}', slug=f'tenant-{tenant_id}', description='')
+
+    def device_ref(self, device_id):
+        return brief('dcim/devices', device_id, f'device-{device_id}', description='')
+
+    def tenants(self):
+        for tenant_id in range(1, self.tenant_count + 1):
+            yield dict(self.tenant_ref(tenant_id), group=None, comments='', tags=[], custom_fields={}, created=STAMP, last_updated=STAMP)
+
+    def sites(self):
+        rng = random.Random(self.seed + 1)
+        for site_id in range(1, self.site_count + 1):
+            lat, lon = round(rng.uniform(-55, 70), 6), round(rng.uniform(-160, 175), 6)
+            located = rng.random() >= self.unlocated_site_share
+            region, group = site_id % 25 + 1, site_id % 10 + 1
+            yield dict(self.site_ref(site_id), status={'value': 'active', 'label': 'Active'},
+                       region=brief('dcim/regions', region, f'Region {region}', slug=f'region-{region}', _depth=0),
+                       group=brief('dcim/site-groups', group, f'Group {group}', slug=f'group-{group}', _depth=0),
+                       tenant=None, facility='', time_zone=None, asns=[],
+                       physical_address=f'{site_id} Synthetic Street, City {site_id % 500}', shipping_address='',
+                       latitude=lat if located else None, longitude=lon if located else None,
+                       comments='', tags=[], custom_fields={}, created=STAMP, last_updated=STAMP)
+
+    def devices(self):
+        rng = random.Random(self.seed + 2)
+        for device_id in range(1, self.device_count + 1):
+            index = device_id - 1
+            tenant_id, status = self.device_tenant[index], STATUSES[self.device_status[index]]
+            own_location = rng.random() < 0.1
+            address = f'10.{device_id >> 16 & 255}.{device_id >> 8 & 255}.{device_id & 255}/31'
+            ip4 = {'id': device_id, 'url': f'/api/ipam/ip-addresses/{device_id}/', 'display': address,
+                   'family': {'value': 4, 'label': 'IPv4'}, 'address': address, 'description': ''}
+            yield dict(self.device_ref(device_id), device_type=DEVICE_TYPE,
+                       role=NODE_ROLE if self.device_node[index] else OTHER_ROLE,
+                       tenant=self.tenant_ref(tenant_id) if tenant_id else None,
+                       platform=None, serial=f'SN{device_id:08d}', asset_tag=None,
+                       site=self.site_ref(self.device_site[index]), location=None, rack=None, position=None, face=None,
+                       latitude=round(rng.uniform(-55, 70), 6) if own_location else None,
+                       longitude=round(rng.uniform(-160, 175), 6) if own_location else None,
+                       parent_device=None, status={'value': status[0], 'label': status[1]}, airflow=None,
+                       primary_ip=ip4, primary_ip4=ip4, primary_ip6=None, oob_ip=None,
+                       cluster=None, virtual_chassis=None, vc_position=None, vc_priority=None,
+                       comments='', config_template=None, local_context_data=None,
+                       tags=[brief('extras/tags', 1, 'backbone', slug='backbone', color='2196f3')] if device_id % 5 == 0 else [],
+                       custom_fields={'pop': f'POP{device_id % 40}'}, created=STAMP, last_updated=STAMP)
+
+    def _interface(self, device_id, number):
+        return {'object_type': 'dcim.interface', 'object_id': device_id * 1000 + number,
+                'object': {'id': device_id * 1000 + number, 'url': f'/api/dcim/interfaces/{device_id * 1000 + number}/',
+                           'display': f'et-0/0/{number}', 'device': self.device_ref(device_id),
+                           'name': f'et-0/0/{number}', 'description': f'to backbone {number}', 'cable': None, '_occupied': True}}
+
+    @staticmethod
+    def _circuit_term(term_id, circuit_id):
+        return {'object_type': 'circuits.circuittermination', 'object_id': term_id,
+                'object': {'id': term_id, 'url': f'/api/circuits/circuit-terminations/{term_id}/', 'display': f'CID-{circuit_id:07d}: Termination',
+                           'circuit': {'id': circuit_id, 'url': f'/api/circuits/circuits/{circuit_id}/', 'display': f'CID-{circuit_id:07d}', 'cid': f'CID-{circuit_id:07d}', 'description': ''},
+                           'term_side': 'A' if term_id % 2 else 'Z', 'description': '', 'cable': None, '_occupied': True}}
+
+    def _walk_links(self):
+        """Yields (link number, kind, a, b, circuit id) with circuit ids numbered in link order."""
+        circuit_id = 0
+        for number, (kind, a, b) in enumerate(self.links, 1):
+            if kind != 'cable':
+                circuit_id += 1
+            yield number, kind, a, b, circuit_id if kind != 'cable' else None
+
+    def cables(self):
+        ports = [0] * (self.device_count + 1)
+        cable_id = 0
+        for number, kind, a, b, circuit_id in self._walk_links():
+            ends = []
+            if kind == 'cable':
+                ends.append((self._interface(a, ports[a]), self._interface(b, ports[b])))
+            elif kind == 'cabled_circuit':
+                term_a, term_z = 2 * circuit_id - 1, 2 * circuit_id
+                ends.append((self._interface(a, ports[a]), self._circuit_term(term_a, circuit_id)))
+                ends.append((self._circuit_term(term_z, circuit_id), self._interface(b, ports[b])))
+            else:
+                continue
+            ports[a] += 1
+            ports[b] += 1
+            for a_end, b_end in ends:
+                cable_id += 1
+                yield {'id': cable_id, 'url': f'/api/dcim/cables/{cable_id}/', 'display': f'#{cable_id}', 'type': 'smf',
+                       'a_terminations': [a_end], 'b_terminations': [b_end], 'status': {'value': 'connected', 'label': 'Connected'},
+                       'tenant': None, 'label': '', 'color': '', 'length': None, 'length_unit': None, 'description': '',
+                       'comments': '', 'tags': [], 'custom_fields': {}, 'created': STAMP, 'last_updated': STAMP}
+
+    def _terminations(self, circuit_id, a, b):
+        circuit = {'id': circuit_id, 'url': f'/api/circuits/circuits/{circuit_id}/', 'display': f'CID-{circuit_id:07d}', 'cid': f'CID-{circuit_id:07d}', 'description': ''}
+        for term_id, side, device_id in ((2 * circuit_id - 1, 'A', a), (2 * circuit_id, 'Z', b)):
+            yield {'id': term_id, 'url': f'/api/circuits/circuit-terminations/{term_id}/', 'display': f"{circuit['cid']}: Termination {side}",
+                   'circuit': circuit, 'term_side': side, 'site': self.site_ref(self.device_site[device_id - 1]), 'provider_network': None,
+                   'port_speed': 10000000, 'upstream_speed': None, 'xconnect_id': '', 'pp_info': '', 'description': '',
+                   'mark_connected': False, 'cable': None, 'tags': [], 'custom_fields': {}, 'created': STAMP, 'last_updated': STAMP}
+
+    def circuit_terminations(self):
+        for _, kind, a, b, circuit_id in self._walk_links():
+            if circuit_id:
+                yield from self._terminations(circuit_id, a, b)
+
+    def circuits(self):
+        for _, kind, a, b, circuit_id in self._walk_links():
+            if not circuit_id: continue
+            term_a, term_z = ({key: term[key] for key in ('id', 'url', 'display', 'term_side', 'site', 'port_speed', 'description')}
+                              for term in self._terminations(circuit_id, a, b))
+            tenant_id = self.device_tenant[a - 1]
+            yield {'id': circuit_id, 'url': f'/api/circuits/circuits/{circuit_id}/', 'display': f'CID-{circuit_id:07d}', 'cid': f'CID-{circuit_id:07d}',
+                   'provider': PROVIDER, 'provider_account': None, 'type': brief('circuits/circuit-types', 1, 'Transport', slug='transport'),
+                   'status': {'value': 'active', 'label': 'Active'}, 'tenant': self.tenant_ref(tenant_id) if tenant_id else None,
+                   'install_date': None, 'termination_date': None, 'commit_rate': 10000000, 'description': '',
+                   'termination_a': term_a, 'termination_z': term_z, 'comments': '', 'tags': [], 'custom_fields': {},
+                   'created': STAMP, 'last_updated': STAMP}
+
+    def endpoints(self):
+        """API paths (relative to /api/) and their object generators."""
+        return {
+            'tenancy/tenants/': self.tenants,
+            'dcim/sites/': self.sites,
+            'dcim/devices/': self.devices,
+            'dcim/cables/': self.cables,
+            'circuits/circuits/': self.circuits,
+            'circuits/circuit-terminations/': self.circuit_terminations,
+        }
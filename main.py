@@ -1,10 +1,48 @@
+import gzip
+import hashlib
+import hmac
+import ipaddress
 import json
+import math
+import mmap
+import os
+import random
+import shutil
+import sqlite3
+import sys
+import threading
+import time
+import tracemalloc
 from collections import defaultdict 
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from contextlib import contextmanager
+from itertools import groupby
+from operator import itemgetter
+from datetime import datetime, timedelta, timezone
+from email.utils import formatdate, parsedate_to_datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit, urlunsplit, urljoin, parse_qs, urlencode, quote
 from grenml.managers import GRENMLManager
 from grenml.models import Node, Institution, Link
+from grenml.exceptions import AttributeIdError
+from grenml.validation import TopologyValidator
+from grenml.writing.grenml import (
+    Writer, InstitutionWriter, LinkWriter, NodeWriter, LifetimeWriter, LocationWriter,
+    GRENML_XMLNS_URI, NML_XMLNS_URI, XSI_XMLNS_URI, XSI_SCHEMA_LOCATION,
+)
 from geopy.geocoders import Nominatim
 import requests
 
+try:
+    import resource
+except ImportError:  # not available on Windows
+    resource = None
+
+try:
+    import numpy as np
+except ImportError:  # optional, speeds up GAZETTEER_FILE lookups
+    np = None
+
 # ====================================================================
 # GLOBAL CONFIGURATION FLAGS
 # ====================================================================
@@ -12,12 +50,23 @@ import requests
 # 🚩 Remove nodes that do not have any links
 REMOVE_UNLINKED_NODES = False 
 
+# 🚩 Device role slug and status of the devices exported as GRENML nodes
+NODE_DEVICE_ROLE = 'gp4l-node'
+NODE_DEVICE_STATUS = 'active'
+
 # 🚩 Aggregate nodes by Tenant (ignores aggregation by site)
 AGGREGATE_BY_OWNER = True 
 
 # 🚩 Aggregate devices by SITE (only used if AGGREGATE_BY_OWNER is False)
 AGGREGATE_BY_SITE = False 
 
+# 🚩 Aggregation level: 'device', 'tenant', 'site', 'region', 'site_group' or 'custom_field'
+#    (None keeps the AGGREGATE_BY_OWNER / AGGREGATE_BY_SITE behaviour)
+AGGREGATE_BY = None
+
+# Device custom field whose value groups devices when AGGREGATE_BY is 'custom_field'
+AGGREGATE_CUSTOM_FIELD = None
+
 # 🚩 Anonymize LOCATION data
 ANONYMIZE_LOCATION = True 
 
@@ -33,6 +82,114 @@ ANONYMIZE_INTERFACE_PREFIX = 'if-'
 # 🚩 Anonymize primary_ip/primary_ip4 fields
 ANONYMIZE_IPS = True
 
+# 🚩 Collection backend: 'rest' (full objects from /api/) or 'graphql' (only the fields used here, from /graphql/)
+COLLECTION_BACKEND = 'rest'
+
+# Extra device fields requested from GraphQL, kept as node properties when ANONYMIZE_FIELDS is False
+#    (e.g. 'serial platform { name }')
+GRAPHQL_DEVICE_EXTRA_FIELDS = ''
+
+# 🚩 How IPs and interface aliases are anonymized: 'sequential' (numbered in processing order) or
+#    'keyed' (derived from an HMAC of the NetBox object id: stable across runs and independent of order)
+ANONYMIZATION_MODE = 'sequential'
+
+# Secret key for 'keyed' anonymization (ANONYMIZATION_KEY environment variable). Keep it private and
+#    unchanged between runs, otherwise every replacement IP and alias changes
+ANONYMIZATION_KEY = os.environ.get('ANONYMIZATION_KEY', '')
+
+# 🚩 Fetch pages in parallel (offsets computed from the first page's 'count')
+PARALLEL_FETCH = True
+
+# 🚩 Maximum number of concurrent requests sent to NetBox (across all endpoints)
+FETCH_MAX_WORKERS = 8
+
+# 🚩 Retries per NetBox request on connection errors, timeouts, 429 and 5xx responses
+FETCH_RETRIES = 5
+
+# Initial backoff in seconds, doubled after every retry (with random jitter) and capped at FETCH_BACKOFF_MAX.
+# A Retry-After header sent by NetBox takes precedence.
+FETCH_BACKOFF = 1.0
+FETCH_BACKOFF_MAX = 60
+
+# Seconds to wait for a NetBox response before retrying
+FETCH_TIMEOUT = 60
+
+# 🚩 Directory where completed pages are checkpointed, so a failed run resumes where it stopped (None disables)
+FETCH_CHECKPOINT_DIR = '.netbox_checkpoints'
+
+# Checkpoints older than this many seconds are discarded instead of resumed
+FETCH_CHECKPOINT_MAX_AGE = 6 * 3600
+
+# 🚩 Incremental sync: only fetch objects changed since the previous run and merge them into a local snapshot
+INCREMENTAL_SYNC = False
+
+# File holding the last fetched objects for INCREMENTAL_SYNC
+INCREMENTAL_SNAPSHOT_FILE = 'netbox_snapshot.json'
+
+# Seconds subtracted from the run start time to absorb clock skew between this host and NetBox
+INCREMENTAL_SYNC_OVERLAP = 300
+
+# 🚩 Process device and cable pages as they arrive, keeping compact records instead of full NetBox objects
+STREAM_PAGES = True
+
+# 🚩 Targeted collection: let NetBox filter the node devices (NODE_DEVICE_ROLE / NODE_DEVICE_STATUS), then only
+#    fetch their sites, the cables attached to them and the circuits ending at their sites or cables
+TARGETED_COLLECTION = False
+
+# Object IDs per filtered request (e.g. '&device_id=1&device_id=2...') in TARGETED_COLLECTION
+TARGETED_BATCH_SIZE = 100
+
+# 🚩 Output file name
+OUTPUT_FILE = 'grenml.xml'
+
+# 🚩 Write links to the output file as they are created instead of serializing the whole document at the end
+STREAM_OUTPUT = True
+
+# 🚩 Compress the output with gzip (adds '.gz' to OUTPUT_FILE)
+OUTPUT_GZIP = False
+
+# 🚩 Snapshot mode: None, 'save' (also write the fetched NetBox data to SNAPSHOT_FILE)
+#    or 'replay' (read SNAPSHOT_FILE instead of contacting NetBox)
+SNAPSHOT_MODE = None
+
+# Snapshot file (JSON lines, one page per line); '.gz' compresses it, plain files are memory-mapped on replay
+SNAPSHOT_FILE = 'netbox_data.jsonl.gz'
+
+# 🚩 Output variants built from a single fetch, each in its own worker process. Every entry
+#    overrides configuration flags for one output and must set its own OUTPUT_FILE, e.g.
+#    {'OUTPUT_FILE': 'grenml-site.xml', 'AGGREGATE_BY': 'site', 'ANONYMIZE_FIELDS': False}.
+#    Collection flags (VARIANT_SHARED_FLAGS, and AGGREGATE_CUSTOM_FIELD) are shared by all
+#    variants and cannot be overridden. Empty: single output
+VARIANTS = []
+
+# Maximum number of variant worker processes (None: one per CPU)
+VARIANT_MAX_WORKERS = None
+
+# 🚩 Service mode: keep running with warm caches, refresh objects named by NetBox webhooks
+#    (POST /webhook) and serve the latest output over HTTP with ETags
+SERVICE_MODE = False
+SERVICE_HOST = '127.0.0.1'
+SERVICE_PORT = 8080
+
+# Seconds without new webhooks before rebuilding, and the longest a queued change may wait
+SERVICE_DEBOUNCE = 10
+SERVICE_DEBOUNCE_MAX = 120
+
+# Seconds between full re-fetches that catch changes missed by webhooks (None disables)
+SERVICE_RESYNC_INTERVAL = 24 * 3600
+
+# Secret configured on the NetBox webhook; requests without a matching X-Hook-Signature are rejected (None accepts all)
+SERVICE_WEBHOOK_SECRET = None
+
+# 🚩 JSON run report: wall time and peak memory per stage, HTTP and geocoding statistics, object counts (None disables)
+REPORT_FILE = 'run_report.json'
+
+# 🚩 Also write the report as a Prometheus textfile (e.g. for node_exporter's textfile collector); None disables
+REPORT_PROMETHEUS_FILE = None
+
+# Trace Python allocations for an exact peak per stage (slower); otherwise the process peak RSS is reported
+REPORT_TRACE_MEMORY = False
+
 # Fields to keep even if ANONYMIZE_FIELDS is True
 ANONYMIZATION_EXCEPTIONS = {'status', 'tags'}
 
@@ -42,7 +199,28 @@ HANDLED_KEYS = {
     'url', 'display_url', 'display'
 }
 
-# Geocoding Caches
+# 🚩 Persistent geocoding cache (SQLite file). Set to None to cache in memory only
+GEOCODE_CACHE_FILE = 'geocode_cache.sqlite'
+
+# 🚩 Lifetime (seconds) of cached geocoding results and of 'not found' results
+GEOCODE_CACHE_TTL = 90 * 24 * 3600
+GEOCODE_CACHE_NEGATIVE_TTL = 24 * 3600
+
+# 🚩 Maximum number of persisted geocoding entries (least recently used are evicted)
+GEOCODE_CACHE_MAX_ENTRIES = 50000
+
+# 🚩 Offline reverse geocoding: GeoNames-style cities file (e.g. cities15000.txt) used instead of Nominatim to
+#    anonymize coordinates. Nominatim is then only queried for sites that only have a free-text address. None disables
+GAZETTEER_FILE = None
+
+# Optional GeoNames admin1CodesASCII.txt and countryInfo.txt, to name regions and countries instead of using their codes
+GAZETTEER_ADMIN1_FILE = None
+GAZETTEER_COUNTRY_FILE = None
+
+# Institution that owns every node and devices without a tenant
+generic_owner_id = "urn:org:generic-owner1"
+
+# Geocoding Caches (in-memory, backed by GEOCODE_CACHE_FILE)
 REVERSE_GEOCODE_CACHE = {}
 GEOCODE_CACHE = {}
 
@@ -50,7 +228,8 @@ GEOCODE_CACHE = {}
 # 1. API DATA COLLECTION
 # ====================================================================
 
-baseUrl = 'https://netbox.gp4l.nmaas.eu/api/'
+# NETBOX_URL overrides the API root, e.g. to run against a test instance
+baseUrl = os.environ.get('NETBOX_URL', 'https://netbox.gp4l.nmaas.eu/api/')
 
 def getCredentials():
     # ⬇️ ENTER YOUR TOKEN HERE ⬇️
@@ -66,104 +245,1185 @@ def getCredentials():
         print("WARNING: The 'credentials' variable is empty.")
     return credentials, data_number, headers
 
-def getDevices(data_number, headers):
-    url = baseUrl + 'dcim/devices/?limit=' + data_number
+def getDevices(data_number, headers, query='', stream=False):
+    if COLLECTION_BACKEND == 'graphql':
+        return get_graphql_data('devices', data_number, headers, stream)
+    url = baseUrl + 'dcim/devices/?limit=' + data_number + query
     print(f"Fetching ALL Devices from: {url}")
-    return get_paginated_data(url, headers)
+    pages = METRICS.timed_pages('devices', iter_paginated_data(url, headers))
+    return pages if stream else gather_pages(pages)
 
-def getCables(data_number, headers):
-    url = baseUrl + 'dcim/cables/?limit=' + data_number
+def getCables(data_number, headers, query='', stream=False):
+    if COLLECTION_BACKEND == 'graphql':
+        return get_graphql_data('cables', data_number, headers, stream)
+    url = baseUrl + 'dcim/cables/?limit=' + data_number + query
     print(f"Fetching Cables from: {url}")
-    return get_paginated_data(url, headers)
+    pages = METRICS.timed_pages('cables', iter_paginated_data(url, headers))
+    return pages if stream else gather_pages(pages)
 
-def getSites(data_number, headers):
-    url = baseUrl + 'dcim/sites/?limit=' + data_number
+def getSites(data_number, headers, query=''):
+    if COLLECTION_BACKEND == 'graphql':
+        return get_graphql_data('sites', data_number, headers)
+    url = baseUrl + 'dcim/sites/?limit=' + data_number + query
     print(f"Fetching Sites from: {url}")
-    return get_paginated_data(url, headers)
+    return gather_pages(METRICS.timed_pages('sites', iter_paginated_data(url, headers)))
 
-def getCircuits(data_number, headers):
-    url = baseUrl + 'circuits/circuits/?limit=' + data_number
+def getCircuits(data_number, headers, query=''):
+    if COLLECTION_BACKEND == 'graphql':
+        return get_graphql_data('circuits', data_number, headers)
+    url = baseUrl + 'circuits/circuits/?limit=' + data_number + query
     print(f"Fetching Circuits from: {url}")
-    return get_paginated_data(url, headers)
+    return gather_pages(METRICS.timed_pages('circuits', iter_paginated_data(url, headers)))
+
+def getCircuitTerminations(data_number, headers, query=''):
+    url = baseUrl + 'circuits/circuit-terminations/?limit=' + data_number + query
+    print(f"Fetching Circuit Terminations from: {url}")
+    return gather_pages(METRICS.timed_pages('circuit_terminations', iter_paginated_data(url, headers)))
+
+requests.packages.urllib3.disable_warnings(requests.packages.urllib3.exceptions.InsecureRequestWarning)
+
+# Shared keep-alive session; the semaphore bounds concurrent requests to NetBox.
+# Both are created on first use, so FETCH_MAX_WORKERS can still be changed after import.
+_session = None
+_session_lock = threading.Lock()
+_fetch_semaphore = None
+
+def get_session():
+    global _session, _fetch_semaphore
+    with _session_lock:
+        if _session is None:
+            _session = requests.Session()
+            _session.verify = False
+            adapter = requests.adapters.HTTPAdapter(pool_connections=4, pool_maxsize=FETCH_MAX_WORKERS)
+            _session.mount('https://', adapter)
+            _session.mount('http://', adapter)
+            _fetch_semaphore = threading.BoundedSemaphore(FETCH_MAX_WORKERS)
+        return _session
+
+def get_fetch_semaphore():
+    get_session()
+    return _fetch_semaphore
+
+# Responses retried by fetch_page: rate limiting and transient server or proxy errors
+RETRY_STATUS_CODES = {429, 500, 502, 503, 504}
+# Exceptions retried by fetch_page: connections refused, timed out or dropped while reading the body
+RETRY_EXCEPTIONS = (requests.ConnectionError, requests.Timeout, requests.exceptions.ChunkedEncodingError, requests.exceptions.ContentDecodingError)
+
+class FetchError(Exception):
+    """Raised when a NetBox page cannot be fetched after all retries."""
+
+def retry_delay(attempt, retry_after=None):
+    """Seconds to wait before retry number 'attempt', honouring a Retry-After header when given."""
+    if retry_after:
+        try:
+            return min(max(float(retry_after), 0), FETCH_BACKOFF_MAX)
+        except ValueError:
+            try:
+                wait = (parsedate_to_datetime(retry_after) - datetime.now(timezone.utc)).total_seconds()
+                return min(max(wait, 0), FETCH_BACKOFF_MAX)
+            except (TypeError, ValueError):
+                pass
+    # Full jitter keeps parallel workers from retrying in lockstep
+    return random.uniform(0, min(FETCH_BACKOFF * 2 ** attempt, FETCH_BACKOFF_MAX))
 
-def get_paginated_data(url, headers):
+def fetch_page(url, headers, payload=None):
+    """GETs a REST page, or POSTs a GraphQL `payload`, retrying transient failures."""
+    for attempt in range(FETCH_RETRIES + 1):
+        retry_after = None
+        try:
+            # The semaphore is only held for the request itself, never while backing off
+            with get_fetch_semaphore():
+                start = time.perf_counter()
+                try:
+                    if payload is None:
+                        response = get_session().get(url, headers=headers, timeout=FETCH_TIMEOUT)
+                    else:
+                        response = get_session().post(url, headers=headers, json=payload, timeout=FETCH_TIMEOUT)
+                except requests.RequestException:
+                    METRICS.record_request(time.perf_counter() - start, 'error', 0)
+                    raise
+                METRICS.record_request(time.perf_counter() - start, response.status_code, len(response.content))
+            if response.status_code not in RETRY_STATUS_CODES:
+                response.raise_for_status()
+                data = response.json()
+                if payload is not None and data.get('errors'):
+                    raise FetchError(f"GraphQL query to {url} failed: {data['errors'][0].get('message')}")
+                return data
+            error = f"HTTP {response.status_code}"
+            retry_after = response.headers.get('Retry-After')
+        except RETRY_EXCEPTIONS as err:
+            error = err
+        except (requests.RequestException, ValueError) as err:
+            raise FetchError(f"Fetching {url} failed: {err}") from err
+        if attempt == FETCH_RETRIES:
+            raise FetchError(f"Fetching {url} failed after {FETCH_RETRIES + 1} attempts: {error}")
+        delay = retry_delay(attempt, retry_after)
+        METRICS.count('http', 'retries')
+        print(f"WARNING: {error} from {url}, retrying in {delay:.1f}s ({attempt + 1}/{FETCH_RETRIES})")
+        time.sleep(delay)
+
+def sweep_stale_checkpoints():
+    """
+    Removes every listing directory under FETCH_CHECKPOINT_DIR not written to for FETCH_CHECKPOINT_MAX_AGE,
+    including those of URLs that are never requested again (last_updated__gte timestamps, id= batches).
+    """
     try:
-        requests.packages.urllib3.disable_warnings(requests.packages.urllib3.exceptions.InsecureRequestWarning)
-        response = requests.get(url, headers=headers, verify=False)
-        response.raise_for_status()
-        data = response.json()
-        nextURL = data.get('next')
+        entries = list(os.scandir(FETCH_CHECKPOINT_DIR))
+    except OSError:
+        return
+    now = time.time()
+    for entry in entries:
+        try:
+            stale = entry.is_dir() and now - entry.stat().st_mtime > FETCH_CHECKPOINT_MAX_AGE
+        except OSError:
+            continue
+        if stale:
+            shutil.rmtree(entry.path, ignore_errors=True)
+
+class PageCheckpoint:
+    """Completed pages of one listing URL, stored one JSON file per page URL under FETCH_CHECKPOINT_DIR."""
+
+    def __init__(self, url):
+        self.path = None
+        if FETCH_CHECKPOINT_DIR:
+            self.path = os.path.join(FETCH_CHECKPOINT_DIR, hashlib.sha1(url.encode()).hexdigest()[:16])
+            if os.path.isdir(self.path) and time.time() - os.path.getmtime(self.path) > FETCH_CHECKPOINT_MAX_AGE:
+                print(f"Discarding stale checkpoints for: {url}")
+            sweep_stale_checkpoints()
+
+    def page_path(self, page_url):
+        return os.path.join(self.path, hashlib.sha1(page_url.encode()).hexdigest() + '.json')
+
+    def fetch(self, page_url, headers, payload=None):
+        if self.path is None:
+            return fetch_page(page_url, headers, payload)
+        path = self.page_path(page_url if payload is None else page_url + json.dumps(payload, sort_keys=True))
+        try:
+            with open(path, encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            pass
+        data = fetch_page(page_url, headers, payload)
+        os.makedirs(self.path, exist_ok=True)
+        with open(path + '.tmp', 'w', encoding='utf-8') as f:
+            json.dump(data, f)
+        os.replace(path + '.tmp', path)
+        return data
+
+    def resumed(self):
+        return self.path is not None and os.path.isdir(self.path) and len(os.listdir(self.path)) > 0
+
+    def clear(self):
+        if self.path is not None:
+            shutil.rmtree(self.path, ignore_errors=True)
+            try:
+                os.rmdir(FETCH_CHECKPOINT_DIR)
+            except OSError:
+                pass  # other listings are still checkpointed
+
+def build_page_urls(next_url, count):
+    """Derives every remaining page URL from the first 'next' link, keeping its limit and filters."""
+    parts = urlsplit(next_url)
+    query = parse_qs(parts.query, keep_blank_values=True)
+    limit = int(query['limit'][0])
+    first_offset = int(query.get('offset', [limit])[0])
+    urls = []
+    for offset in range(first_offset, count, limit):
+        query['offset'] = [str(offset)]
+        urls.append(urlunsplit(parts._replace(query=urlencode(query, doseq=True))))
+    return urls
+
+def iter_paginated_data(url, headers):
+    """Yields the results of each page in order, without accumulating them.
+
+    Pages are checkpointed as they complete; the checkpoints are removed once the last page is yielded.
+    """
+    checkpoint = PageCheckpoint(url)
+    if checkpoint.resumed():
+        print(f"Resuming from checkpointed pages of: {url}")
+    data = checkpoint.fetch(url, headers)
+    yield data['results']
+    nextURL = data.get('next')
+    if PARALLEL_FETCH and type(nextURL) == str and data.get('count'):
+        page_urls = build_page_urls(nextURL, data['count'])
+        print(f"Fetching {len(page_urls)} remaining pages in parallel from: {url}")
+        with ThreadPoolExecutor(max_workers=FETCH_MAX_WORKERS) as pool:
+            # map() yields in submission order, so page order is preserved
+            for currentData in pool.map(lambda page_url: checkpoint.fetch(page_url, headers), page_urls):
+                yield currentData['results']
+    else:
         while type(nextURL) == str:
             print(f"Fetching next page: {nextURL}")
-            current_response = requests.get(nextURL, headers=headers, verify=False)
-            current_response.raise_for_status()
-            currentData = current_response.json()
-            data['results'] += currentData['results']
+            currentData = checkpoint.fetch(nextURL, headers)
+            yield currentData['results']
             nextURL = currentData.get('next')
-        print(f"Fetch completed. Total of {len(data.get('results', []))} items.")
-        return data
-    except Exception as err:
-        print(f"An unexpected error occurred: {err}")
-    return {"results": []}
+    checkpoint.clear()
+
+def gather_pages(pages):
+    results = []
+    for page in pages:
+        results += page
+    print(f"Fetch completed. Total of {len(results)} items.")
+    return {"count": len(results), "results": results}
+
+# --- GraphQL Backend ---
+
+GRAPHQL_TERMINATION_FIELDS = (
+    '__typename ... on InterfaceType { id name display description device { id name } } '
+    '... on CircuitTerminationType { id }'
+)
+
+# List query and selected fields per endpoint: only what the node and link passes read
+GRAPHQL_QUERIES = {
+    'devices': ('device_list', 'id name display role { id slug } status site { id name } tenant { id name } '
+                'location { id name } latitude longitude primary_ip4 { id address } primary_ip6 { id address } '
+                'tags { id name slug color } custom_fields'),
+    'cables': ('cable_list', f'id display a_terminations {{ {GRAPHQL_TERMINATION_FIELDS} }} b_terminations {{ {GRAPHQL_TERMINATION_FIELDS} }}'),
+    'sites': ('site_list', 'id name display latitude longitude physical_address description region { id name } group { id name }'),
+    'circuits': ('circuit_list', 'id cid display tenant { id name } '
+                 'termination_a { id term_side site { id name } } termination_z { id term_side site { id name } }'),
+}
+
+GRAPHQL_TERMINATION_TYPES = {'InterfaceType': 'dcim.interface', 'CircuitTerminationType': 'circuits.circuittermination'}
+
+def get_graphql_url():
+    # NetBox serves GraphQL next to the REST API root, i.e. /graphql/ for /api/
+    return urljoin(baseUrl, '../graphql/')
+
+def graphql_id(value):
+    return int(value) if value is not None else None
+
+def graphql_ref(obj):
+    """Nested object with an integer id, like NetBox's brief REST representation."""
+    return dict(obj, id=graphql_id(obj.get('id'))) if obj else None
+
+def graphql_enum(value):
+    # NetBox 4.1+ returns choice fields as enum names (STATUS_ACTIVE, SIDE_A), older versions the raw value
+    if isinstance(value, str) and value.isupper() and '_' in value:
+        return value.split('_', 1)[1]
+    return value
+
+def graphql_float(value):
+    return float(value) if value is not None else None
+
+def graphql_ip(ip):
+    if not ip: return None
+    family = 6 if ':' in ip['address'] else 4
+    return {'id': graphql_id(ip.get('id')), 'family': {'value': family, 'label': f'IPv{family}'}, 'address': ip['address']}
+
+def normalize_graphql_device(device):
+    status = str(graphql_enum(device.get('status')) or '').lower()
+    device = dict(device,
+        id=graphql_id(device.get('id')),
+        role=graphql_ref(device.get('role')),
+        status={'value': status, 'label': status.replace('-', ' ').capitalize()} if status else None,
+        site=graphql_ref(device.get('site')),
+        tenant=graphql_ref(device.get('tenant')),
+        location=graphql_ref(device.get('location')),
+        latitude=graphql_float(device.get('latitude')),
+        longitude=graphql_float(device.get('longitude')),
+        primary_ip4=graphql_ip(device.get('primary_ip4')),
+        primary_ip6=graphql_ip(device.get('primary_ip6')),
+        tags=[graphql_ref(tag) for tag in device.get('tags') or []],
+    )
+    device['primary_ip'] = device['primary_ip4'] or device['primary_ip6']
+    return device
+
+def normalize_graphql_termination(term):
+    obj = dict(term)
+    typename = obj.pop('__typename', None)
+    if 'id' in obj: obj['id'] = graphql_id(obj['id'])
+    if obj.get('device'): obj['device'] = graphql_ref(obj['device'])
+    return {'object_type': GRAPHQL_TERMINATION_TYPES.get(typename, typename), 'object_id': obj.get('id'), 'object': obj}
+
+def normalize_graphql_cable(cable):
+    return dict(cable,
+        id=graphql_id(cable.get('id')),
+        a_terminations=[normalize_graphql_termination(t) for t in cable.get('a_terminations') or []],
+        b_terminations=[normalize_graphql_termination(t) for t in cable.get('b_terminations') or []],
+    )
 
-# --- Collection Execution ---
-credentials, data_number, headers = getCredentials()
-all_devices_data = getDevices(data_number, headers)
-cables_data = getCables(data_number, headers)
-sites_data = getSites(data_number, headers)
-circuits_data = getCircuits(data_number, headers)
+def normalize_graphql_site(site):
+    return dict(site,
+        id=graphql_id(site.get('id')),
+        latitude=graphql_float(site.get('latitude')),
+        longitude=graphql_float(site.get('longitude')),
+        region=graphql_ref(site.get('region')),
+        group=graphql_ref(site.get('group')),
+    )
 
-sites_map = {site['id']: site for site in sites_data.get('results', [])}
+def normalize_graphql_circuit_termination(term):
+    if not term: return None
+    return dict(term, id=graphql_id(term.get('id')), term_side=graphql_enum(term.get('term_side')), site=graphql_ref(term.get('site')))
+
+def normalize_graphql_circuit(circuit):
+    return dict(circuit,
+        id=graphql_id(circuit.get('id')),
+        tenant=graphql_ref(circuit.get('tenant')),
+        termination_a=normalize_graphql_circuit_termination(circuit.get('termination_a')),
+        termination_z=normalize_graphql_circuit_termination(circuit.get('termination_z')),
+    )
+
+GRAPHQL_NORMALIZERS = {
+    'devices': normalize_graphql_device,
+    'cables': normalize_graphql_cable,
+    'sites': normalize_graphql_site,
+    'circuits': normalize_graphql_circuit,
+}
+
+def iter_graphql_pages(endpoint, data_number, headers):
+    """
+    Yields pages of `endpoint` from the GraphQL API, normalized to the REST shape.
+    GraphQL lists carry no total count, so pages are requested one after the other until a short page.
+    """
+    list_name, fields = GRAPHQL_QUERIES[endpoint]
+    if endpoint == 'devices' and GRAPHQL_DEVICE_EXTRA_FIELDS:
+        fields += ' ' + GRAPHQL_DEVICE_EXTRA_FIELDS
+    url, limit, normalize = get_graphql_url(), int(data_number), GRAPHQL_NORMALIZERS[endpoint]
+    query = f'query($offset: Int!, $limit: Int!) {{ {list_name}(pagination: {{offset: $offset, limit: $limit}}) {{ {fields} }} }}'
+    checkpoint = PageCheckpoint(url + '#' + list_name)
+    if checkpoint.resumed():
+        print(f"Resuming from checkpointed pages of: {list_name}")
+    offset = 0
+    while True:
+        data = checkpoint.fetch(url, headers, {'query': query, 'variables': {'offset': offset, 'limit': limit}})
+        items = data['data'][list_name]
+        yield [normalize(item) for item in items]
+        if len(items) < limit:
+            break
+        offset += limit
+        print(f"Fetching next page: {list_name} offset {offset}")
+    checkpoint.clear()
+
+def get_graphql_data(endpoint, data_number, headers, stream=False):
+    print(f"Fetching {endpoint} from: {get_graphql_url()} ({GRAPHQL_QUERIES[endpoint][0]})")
+    pages = METRICS.timed_pages(endpoint, iter_graphql_pages(endpoint, data_number, headers))
+    return pages if stream else gather_pages(pages)
+
+def collect_all(data_number, headers, query=''):
+    """Runs the four collectors, concurrently when PARALLEL_FETCH is enabled."""
+    collectors = (getDevices, getCables, getSites, getCircuits)
+    if not PARALLEL_FETCH:
+        return [collector(data_number, headers, query) for collector in collectors]
+    with ThreadPoolExecutor(max_workers=len(collectors)) as pool:
+        futures = [pool.submit(collector, data_number, headers, query) for collector in collectors]
+        return [future.result() for future in futures]
+
+SNAPSHOT_KEYS = ('devices', 'cables', 'sites', 'circuits')
+
+def load_sync_snapshot():
+    if not os.path.exists(INCREMENTAL_SNAPSHOT_FILE):
+        return None
+    try:
+        with open(INCREMENTAL_SNAPSHOT_FILE, encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError) as e:
+        print(f"Ignoring unreadable snapshot '{INCREMENTAL_SNAPSHOT_FILE}': {e}")
+        return None
+
+def save_sync_snapshot(synced_at, datasets):
+    snapshot = {'synced_at': synced_at}
+    for key, data in zip(SNAPSHOT_KEYS, datasets):
+        snapshot[key] = data['results']
+    tmp_file = INCREMENTAL_SNAPSHOT_FILE + '.tmp'
+    with open(tmp_file, "w", encoding="utf-8") as f:
+        json.dump(snapshot, f, ensure_ascii=False)
+    os.replace(tmp_file, INCREMENTAL_SNAPSHOT_FILE)
+
+def merge_changes(previous, changed, listing):
+    """Applies changed objects to the previous results; the ID listing drops deletions and gives NetBox's order."""
+    merged = {obj['id']: obj for obj in previous}
+    merged.update((obj['id'], obj) for obj in changed)
+    return [merged[obj['id']] for obj in listing if obj['id'] in merged]
+
+def collect_incremental(data_number, headers):
+    """Fetches only objects updated since the last snapshot, plus a brief ID listing to detect deletions."""
+    synced_at = (datetime.now(timezone.utc) - timedelta(seconds=INCREMENTAL_SYNC_OVERLAP)).strftime('%Y-%m-%dT%H:%M:%SZ')
+    snapshot = load_sync_snapshot()
+    if snapshot is None:
+        print("No incremental snapshot found, running a full fetch.")
+        datasets = collect_all(data_number, headers)
+        save_sync_snapshot(synced_at, datasets)
+        return datasets
+
+    print(f"Incremental sync of objects updated since {snapshot['synced_at']}")
+    changed_sets = collect_all(data_number, headers, '&last_updated__gte=' + quote(snapshot['synced_at']))
+    listings = collect_all(data_number, headers, '&brief=1')
+
+    datasets = []
+    for key, changed, listing in zip(SNAPSHOT_KEYS, changed_sets, listings):
+        results = merge_changes(snapshot[key], changed['results'], listing['results'])
+        listed_ids = {obj['id'] for obj in listing['results']}
+        deleted = sum(1 for obj in snapshot[key] if obj['id'] not in listed_ids)
+        print(f"Incremental {key}: {len(changed['results'])} changed, {deleted} deleted, {len(results)} total.")
+        datasets.append({'count': len(results), 'results': results})
+    save_sync_snapshot(synced_at, datasets)
+    return datasets
+
+# --- Compact Records ---
+
+def get_device_from_termination(term):
+    if term.get('object_type') == 'dcim.interface':
+        return term.get('object', {}).get('device', {}).get('id')
+    return None
+
+def get_circuit_term_from_termination(term):
+    if term.get('object_type') == 'circuits.circuittermination':
+        return term.get('object', {}).get('id')
+    return None
+
+def is_node_device(device):
+    """Devices exported as GRENML nodes."""
+    return device.role_slug == NODE_DEVICE_ROLE and device.status == NODE_DEVICE_STATUS
+
+class DeviceRecord:
+    """The few device keys read by the node and link passes."""
+    __slots__ = ('id', 'name', 'site_id', 'tenant_id', 'role_slug', 'status', 'custom_field')
+
+    def __init__(self, device):
+        self.id = device.get('id')
+        self.name = device.get('name')
+        self.site_id = (device.get('site') or {}).get('id')
+        self.tenant_id = (device.get('tenant') or {}).get('id')
+        role_slug = (device.get('role') or {}).get('slug')
+        status = (device.get('status') or {}).get('value')
+        self.role_slug = sys.intern(role_slug) if role_slug else None
+        self.status = sys.intern(status) if status else None
+        self.custom_field = custom_field_value(device, AGGREGATE_CUSTOM_FIELD) if AGGREGATE_CUSTOM_FIELD else None
+
+    @property
+    def owner_urn(self):
+        return f"urn:netbox:tenant:{self.tenant_id}" if self.tenant_id else generic_owner_id
+
+class CableRecord:
+    """Cable endpoints (device or circuit termination ids); terminations are kept as JSON only for device-to-device cables."""
+    __slots__ = ('id', 'name', 'a_device', 'b_device', 'a_circuit_term', 'b_circuit_term', 'a_terminations', 'b_terminations')
+
+    def __init__(self, cable):
+        t_a, t_b = cable['a_terminations'][0], cable['b_terminations'][0]
+        self.id = cable['id']
+        self.name = cable.get('display') or f"Cable {cable['id']}"
+        self.a_device, self.b_device = get_device_from_termination(t_a), get_device_from_termination(t_b)
+        self.a_circuit_term, self.b_circuit_term = get_circuit_term_from_termination(t_a), get_circuit_term_from_termination(t_b)
+        device_to_device = self.a_device and self.b_device
+        self.a_terminations = json.dumps(cable['a_terminations']) if device_to_device else None
+        self.b_terminations = json.dumps(cable['b_terminations']) if device_to_device else None
+
+def custom_field_value(device, field):
+    value = (device.get('custom_fields') or {}).get(field)
+    if isinstance(value, dict):
+        value = value.get('display') or value.get('name') or value.get('id')
+    elif isinstance(value, list):
+        value = ", ".join(str(v.get('display', v) if isinstance(v, dict) else v) for v in value) or None
+    return value
+
+def compact_devices(pages, aggregations, sites_map):
+    """
+    Reduces pages of devices to DeviceRecords, one interned tenant object per tenant
+    and the full dicts of the first device for each (aggregation level, key).
+    """
+    records, tenants, representatives = [], {}, {}
+    for page in pages:
+        for device in page:
+            if not device.get('id'): continue
+            record = DeviceRecord(device)
+            records.append(record)
+            if record.tenant_id and record.tenant_id not in tenants:
+                tenants[record.tenant_id] = device['tenant']
+            for aggregation in aggregations:
+                key = aggregation.representative_key(record, sites_map)
+                if key is not None and (aggregation.level, key) not in representatives:
+                    representatives[(aggregation.level, key)] = device
+    return records, tenants, representatives
+
+def compact_cables(pages):
+    records = []
+    for page in pages:
+        for cable in page:
+            try: records.append(CableRecord(cable))
+            except: continue
+    return records
+
+def consume_pages(pages, compact):
+    result = compact(pages)
+    print(f"Fetch completed. Total of {len(result[0] if isinstance(result, tuple) else result)} items.")
+    return result
+
+def collect_streaming(data_number, headers, aggregations, snapshot=None):
+    """
+    Like collect_all, but devices and cables are compacted page by page as they arrive.
+    Sites are fetched first, since aggregation keys may depend on them. Raw pages are
+    also written to `snapshot` when one is given.
+    """
+    def raw_pages(endpoint, pages):
+        return snapshot.tee(endpoint, pages) if snapshot else pages
+
+    sites_data = getSites(data_number, headers)
+    sites_map = {site['id']: site for site in sites_data.get('results', [])}
+    tasks = (
+        lambda: consume_pages(raw_pages('devices', getDevices(data_number, headers, stream=True)), lambda pages: compact_devices(pages, aggregations, sites_map)),
+        lambda: consume_pages(raw_pages('cables', getCables(data_number, headers, stream=True)), compact_cables),
+        lambda: getCircuits(data_number, headers),
+    )
+    if not PARALLEL_FETCH:
+        devices_index, cable_records, circuits_data = [task() for task in tasks]
+    else:
+        with ThreadPoolExecutor(max_workers=len(tasks)) as pool:
+            futures = [pool.submit(task) for task in tasks]
+            devices_index, cable_records, circuits_data = [future.result() for future in futures]
+    if snapshot:
+        snapshot.write_results('sites', sites_data.get('results', []))
+        snapshot.write_results('circuits', circuits_data.get('results', []))
+    return devices_index, cable_records, sites_data, circuits_data
+
+# --- Targeted Collection ---
+
+# Device fields needed to select and aggregate nodes; node representatives are fetched again in full
+TARGETED_DEVICE_FIELDS = ('id', 'name', 'site', 'tenant', 'role', 'status')
+
+def fetch_by_ids(collector, data_number, headers, name, ids, query=''):
+    """
+    Runs `collector` with the ids as a repeated `name` filter, TARGETED_BATCH_SIZE ids per request
+    (concurrently when PARALLEL_FETCH is enabled), and returns the results deduplicated by id.
+    """
+    ids = sorted(ids)
+    queries = [query + ''.join(f"&{name}={i}" for i in ids[start:start + TARGETED_BATCH_SIZE]) for start in range(0, len(ids), TARGETED_BATCH_SIZE)]
+    if PARALLEL_FETCH and len(queries) > 1:
+        with ThreadPoolExecutor(max_workers=min(len(queries), FETCH_MAX_WORKERS)) as pool:
+            batches = list(pool.map(lambda batch_query: collector(data_number, headers, batch_query), queries))
+    else:
+        batches = [collector(data_number, headers, batch_query) for batch_query in queries]
+    results = {}
+    for batch in batches:
+        for obj in batch['results']:
+            results.setdefault(obj['id'], obj)
+    return list(results.values())
+
+def first_device_ids(aggregations, records, sites_map, headers):
+    """
+    (level, key) -> id of the first device of each key among all devices in NetBox, whatever its role, for
+    the aggregations with a device_filter. One `limit=1&fields=id` request per key, concurrently when PARALLEL_FETCH.
+    """
+    queries = {}
+    for aggregation in aggregations:
+        for record in records:
+            key = aggregation.representative_key(record, sites_map)
+            if key is None or (aggregation.level, key) in queries: continue
+            query = aggregation.device_filter(key, record)
+            if query: queries[(aggregation.level, key)] = query
+    if not queries:
+        return {}
+    print(f"Fetching the first device of {len(queries)} nodes from: {baseUrl}dcim/devices/?limit=1&fields=id")
+
+    def first_id(query):
+        results = fetch_page(f"{baseUrl}dcim/devices/?limit=1&fields=id{query}", headers)['results']
+        return results[0]['id'] if results else None
+    if PARALLEL_FETCH:
+        with ThreadPoolExecutor(max_workers=FETCH_MAX_WORKERS) as pool:
+            ids = list(pool.map(first_id, queries.values()))
+    else:
+        ids = [first_id(query) for query in queries.values()]
+    return {level_key: device_id for level_key, device_id in zip(queries, ids) if device_id is not None}
+
+def circuit_order(circuit):
+    """NetBox's default circuit ordering (provider, provider account, circuit ID)."""
+    return ((circuit.get('provider') or {}).get('name') or '', (circuit.get('provider_account') or {}).get('account') or '', circuit.get('cid') or '')
+
+def collect_targeted(data_number, headers, aggregations, snapshot=None):
+    """
+    Fetches the node devices selected by NetBox filters first, then only what they need: their sites,
+    the cables attached to them (device_id=), and the circuits terminating at their sites (site_id=)
+    or on their cables (through the circuit terminations). Unless devices are aggregated individually,
+    devices are listed with TARGETED_DEVICE_FIELDS only and the node representatives are fetched in full.
+    Representatives are the first device of each key in NetBox where the aggregation has a device_filter.
+    """
+    full_devices = any(aggregation.level == 'device' for aggregation in aggregations)
+    query = f"&role={quote(NODE_DEVICE_ROLE)}&status={quote(NODE_DEVICE_STATUS)}"
+    if not full_devices:
+        query += '&fields=' + ','.join(TARGETED_DEVICE_FIELDS + (('custom_fields',) if AGGREGATE_CUSTOM_FIELD else ()))
+    devices = getDevices(data_number, headers, query)['results']
+    device_ids = [device['id'] for device in devices]
+    site_ids = {device['site']['id'] for device in devices if device.get('site')}
+
+    tasks = (
+        lambda: fetch_by_ids(getSites, data_number, headers, 'id', site_ids),
+        lambda: fetch_by_ids(getCables, data_number, headers, 'device_id', device_ids),
+        lambda: fetch_by_ids(getCircuits, data_number, headers, 'site_id', site_ids),
+    )
+    if not PARALLEL_FETCH:
+        sites, cables, circuits = [task() for task in tasks]
+    else:
+        with ThreadPoolExecutor(max_workers=len(tasks)) as pool:
+            futures = [pool.submit(task) for task in tasks]
+            sites, cables, circuits = [future.result() for future in futures]
+    sites_map = {site['id']: site for site in sites}
+    cables.sort(key=itemgetter('id'))
+    cable_records = compact_cables([cables])
+
+    # Circuits reached through cables may terminate away from the node sites
+    term_ids = {term for cable in cable_records for term in (cable.a_circuit_term, cable.b_circuit_term) if term}
+    terminations = fetch_by_ids(getCircuitTerminations, data_number, headers, 'id', term_ids, '&brief=1')
+    circuit_ids = {term['circuit']['id'] for term in terminations if term.get('circuit')} - {circuit['id'] for circuit in circuits}
+    circuits = sorted(circuits + fetch_by_ids(getCircuits, data_number, headers, 'id', circuit_ids), key=circuit_order)
+
+    # Like a full fetch, the first device of each key represents the node even when it is not a node device
+    records, tenants, representatives = compact_devices([devices], aggregations, sites_map)
+    representative_ids = {level_key: device['id'] for level_key, device in representatives.items()}
+    representative_ids.update(first_device_ids(aggregations, records, sites_map, headers))
+    full = {device['id']: device for device in devices} if full_devices else {}
+    missing_ids = set(representative_ids.values()) - set(full)
+    full.update((device['id'], device) for device in fetch_by_ids(getDevices, data_number, headers, 'id', missing_ids))
+    representatives = {level_key: full.get(device_id, representatives[level_key]) for level_key, device_id in representative_ids.items()}
+    devices = [full.get(device['id'], device) for device in devices]
+    # Representatives that are not node devices may sit at sites without nodes
+    missing_site_ids = {device['site']['id'] for device in representatives.values() if device.get('site')} - set(sites_map)
+    for site in fetch_by_ids(getSites, data_number, headers, 'id', missing_site_ids):
+        sites.append(site)
+        sites_map[site['id']] = site
+    print(f"Targeted collection: {len(devices)} node devices, {len(cables)} cables, {len(sites)} sites and {len(circuits)} circuits.")
+    if snapshot:
+        for key, results in zip(SNAPSHOT_KEYS, (devices, cables, sites, circuits)):
+            snapshot.write_results(key, results)
+        snapshot.write_results('representatives', [{'level': level, 'key': key, 'device': device} for (level, key), device in representatives.items()])
+    return (records, tenants, representatives), cable_records, sites_map, circuits
+
+# --- Snapshot / Replay ---
+
+# Endpoint order inside a snapshot file: sites come before devices so replay can aggregate on the fly.
+# Targeted snapshots add the node representatives, since their devices are not all in 'devices'.
+SNAPSHOT_FILE_ORDER = ('sites', 'circuits', 'devices', 'representatives', 'cables')
+
+class SnapshotWriter:
+    """
+    Writes raw result pages to SNAPSHOT_FILE, one JSON line per page. Each endpoint goes to its
+    own temporary file, so concurrent collectors never interleave, and close() joins them in
+    SNAPSHOT_FILE_ORDER (gzip members can be concatenated into a single valid stream).
+    """
+
+    def __init__(self, path, page_size=1000):
+        self.path = path
+        self.page_size = page_size
+        self.compress = path.endswith('.gz')
+        self._files = {}
+
+    def _open(self, part):
+        if part not in self._files:
+            tmp_path = f"{self.path}.{part}.tmp"
+            self._files[part] = (tmp_path, gzip.open(tmp_path, 'wt', encoding='utf-8') if self.compress else open(tmp_path, 'w', encoding='utf-8'))
+        return self._files[part][1]
+
+    def write_page(self, endpoint, page):
+        self._open(endpoint).write(json.dumps({'endpoint': endpoint, 'results': page}, ensure_ascii=False, separators=(',', ':')) + '\n')
+
+    def write_results(self, endpoint, results):
+        for start in range(0, len(results), self.page_size):
+            self.write_page(endpoint, results[start:start + self.page_size])
+
+    def tee(self, endpoint, pages):
+        for page in pages:
+            self.write_page(endpoint, page)
+            yield page
+
+    def close(self):
+        header = {'snapshot': 1, 'created_at': datetime.now(timezone.utc).isoformat(), 'source': baseUrl}
+        self._open('header').write(json.dumps(header) + '\n')
+        for _, f in self._files.values():
+            f.close()
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'wb') as out:
+            for part in ('header',) + SNAPSHOT_FILE_ORDER:
+                if part in self._files:
+                    with open(self._files[part][0], 'rb') as f:
+                        shutil.copyfileobj(f, out)
+        os.replace(tmp_path, self.path)
+        for part_path, _ in self._files.values():
+            os.remove(part_path)
+        print(f"Snapshot saved to '{self.path}'.")
+
+def read_snapshot(path):
+    """Yields (endpoint, page) pairs in file order; uncompressed snapshots are memory-mapped."""
+    if path.endswith('.gz'):
+        with gzip.open(path, 'rb') as f:
+            for line in f:
+                entry = json.loads(line)
+                if 'endpoint' in entry: yield entry['endpoint'], entry['results']
+    else:
+        with open(path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            for line in iter(mm.readline, b''):
+                entry = json.loads(line)
+                if 'endpoint' in entry: yield entry['endpoint'], entry['results']
+
+def replay_snapshot(aggregations):
+    """Loads a snapshot in one sequential pass, compacting devices and cables page by page."""
+    print(f"Replaying NetBox data from '{SNAPSHOT_FILE}'")
+    sites_map, circuits = {}, []
+    devices_index, cable_records = compact_devices([], aggregations, sites_map), []
+    for endpoint, entries in groupby(read_snapshot(SNAPSHOT_FILE), key=itemgetter(0)):
+        pages = (page for _, page in entries)
+        if endpoint == 'sites':
+            sites_map = {site['id']: site for page in pages for site in page}
+        elif endpoint == 'circuits':
+            circuits = [circuit for page in pages for circuit in page]
+        elif endpoint == 'devices':
+            devices_index = compact_devices(pages, aggregations, sites_map)
+        elif endpoint == 'representatives':
+            devices_index[2].update(((entry['level'], entry['key']), entry['device']) for page in pages for entry in page)
+        elif endpoint == 'cables':
+            cable_records = compact_cables(pages)
+    print(f"Replayed {len(devices_index[0])} devices, {len(cable_records)} cables, {len(sites_map)} sites and {len(circuits)} circuits.")
+    return devices_index, cable_records, sites_map, circuits
 
 # ====================================================================
 # 3. HELPER FUNCTIONS
 # ====================================================================
 
+# --- Run Report ---
+
+def peak_rss():
+    """Peak resident set size of the process in bytes, or None where it cannot be read."""
+    if resource is None:
+        return None
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss if sys.platform == 'darwin' else rss * 1024
+
+def current_rss():
+    """Current resident set size of the process in bytes (from /proc, Linux only), or None."""
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, IndexError, AttributeError):
+        return None
+
+def percentile(sorted_values, fraction):
+    """Nearest-rank percentile of an already sorted list."""
+    if not sorted_values:
+        return None
+    return sorted_values[max(0, int(len(sorted_values) * fraction + 0.999999) - 1)]
+
+class RunMetrics:
+    """Stage timings, HTTP statistics and counters collected during a run (thread-safe)."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.started_at = time.time()
+        self.stages, self.endpoints, self.objects, self.variants = {}, {}, {}, {}
+        self.counters = defaultdict(lambda: defaultdict(int))
+        self.http_status = defaultdict(int)
+        self.latencies, self.bytes_received = [], 0
+
+    def count(self, group, name, n=1):
+        with self.lock:
+            self.counters[group][name] += n
+
+    def set_objects(self, **counts):
+        with self.lock:
+            self.objects.update(counts)
+
+    def record_request(self, seconds, status, size):
+        with self.lock:
+            self.latencies.append(seconds)
+            self.http_status[str(status)] += 1
+            self.bytes_received += size
+
+    @contextmanager
+    def stage(self, name):
+        """Times a pipeline stage; stages must not overlap when REPORT_TRACE_MEMORY is on."""
+        if tracemalloc.is_tracing():
+            tracemalloc.reset_peak()
+        start, peak_before = time.perf_counter(), peak_rss()
+        try:
+            yield
+        finally:
+            seconds, peak_after = time.perf_counter() - start, peak_rss()
+            with self.lock:
+                entry = self.stages.setdefault(name, {'seconds': 0.0, 'calls': 0})
+                entry['seconds'] += seconds
+                entry['calls'] += 1
+                if peak_after is not None:
+                    # How far the process peak rose during the stage (0 when an earlier stage used more)
+                    entry['peak_rss_growth_bytes'] = max(entry.get('peak_rss_growth_bytes', 0), peak_after - peak_before)
+                rss = current_rss()
+                if rss is not None:
+                    entry['rss_bytes'] = rss
+                if tracemalloc.is_tracing():
+                    entry['peak_traced_bytes'] = max(entry.get('peak_traced_bytes', 0), tracemalloc.get_traced_memory()[1])
+
+    def timed_pages(self, endpoint, pages):
+        """Passes pages through, recording the time until the last page has been consumed."""
+        start, page_count, item_count = time.perf_counter(), 0, 0
+        try:
+            for page in pages:
+                page_count += 1
+                item_count += len(page)
+                yield page
+        finally:
+            with self.lock:
+                entry = self.endpoints.setdefault(endpoint, {'seconds': 0.0, 'pages': 0, 'items': 0})
+                entry['seconds'] += time.perf_counter() - start
+                entry['pages'] += page_count
+                entry['items'] += item_count
+
+    def report(self, success=None):
+        with self.lock:
+            latencies = sorted(self.latencies)
+            return {
+                'started_at': datetime.fromtimestamp(self.started_at, timezone.utc).strftime('%Y-%m-%dT%H:%M:%SZ'),
+                'duration_seconds': time.time() - self.started_at,
+                'success': success,
+                'peak_rss_bytes': peak_rss(),
+                'stages': self.stages,
+                'endpoints': self.endpoints,
+                'http': {
+                    'requests': len(latencies),
+                    'retries': self.counters['http']['retries'],
+                    'bytes_received': self.bytes_received,
+                    'status': dict(self.http_status),
+                    'latency_seconds': {
+                        'mean': sum(latencies) / len(latencies) if latencies else None,
+                        'p50': percentile(latencies, 0.5),
+                        'p90': percentile(latencies, 0.9),
+                        'p99': percentile(latencies, 0.99),
+                        'max': latencies[-1] if latencies else None,
+                    },
+                },
+                'geocoding': dict(self.counters['geocoding']),
+                'objects': self.objects,
+                'variants': self.variants,
+            }
+
+METRICS = RunMetrics()
+
+def prometheus_label(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def prometheus_lines(report):
+    """Renders a run report in the Prometheus text exposition format."""
+    lines = []
+
+    def metric(name, help_text, samples):
+        samples = [(labels, value) for labels, value in samples if value is not None]
+        if not samples: return
+        lines.append(f"# HELP netbox2grenml_{name} {help_text}")
+        lines.append(f"# TYPE netbox2grenml_{name} gauge")
+        for labels, value in samples:
+            label_text = ','.join(f'{k}="{prometheus_label(v)}"' for k, v in labels.items())
+            lines.append(f"netbox2grenml_{name}{{{label_text}}} {float(value)!r}" if label_text else f"netbox2grenml_{name} {float(value)!r}")
+
+    scopes = [({}, report)] + [({'variant': name}, variant) for name, variant in report['variants'].items()]
+    metric('last_run_timestamp_seconds', 'Unix time at which the last run finished.', [({}, time.time())])
+    metric('last_run_success', '1 if the last run wrote its output, 0 otherwise.', [({}, report['success'])])
+    metric('last_run_duration_seconds', 'Wall time of the last run.', [({}, report['duration_seconds'])])
+    metric('peak_rss_bytes', 'Peak resident set size of the process.', [({}, report['peak_rss_bytes'])])
+    metric('stage_duration_seconds', 'Wall time spent in each pipeline stage.',
+           [(dict(scope, stage=stage), entry['seconds']) for scope, data in scopes for stage, entry in data['stages'].items()])
+    metric('stage_peak_rss_growth_bytes', 'Growth of the process peak resident set size during each stage.',
+           [(dict(scope, stage=stage), entry.get('peak_rss_growth_bytes')) for scope, data in scopes for stage, entry in data['stages'].items()])
+    metric('stage_rss_bytes', 'Resident set size of the process at the end of each stage.',
+           [(dict(scope, stage=stage), entry.get('rss_bytes')) for scope, data in scopes for stage, entry in data['stages'].items()])
+    metric('stage_peak_traced_bytes', 'Peak memory allocated by Python during each stage (REPORT_TRACE_MEMORY).',
+           [(dict(scope, stage=stage), entry.get('peak_traced_bytes')) for scope, data in scopes for stage, entry in data['stages'].items()])
+    metric('endpoint_duration_seconds', 'Wall time until the last page of each NetBox endpoint was processed.',
+           [({'endpoint': endpoint}, entry['seconds']) for endpoint, entry in report['endpoints'].items()])
+    metric('endpoint_items', 'Objects received from each NetBox endpoint.',
+           [({'endpoint': endpoint}, entry['items']) for endpoint, entry in report['endpoints'].items()])
+    metric('http_requests', 'HTTP requests sent to NetBox, by status code.',
+           [({'status': status}, n) for status, n in report['http']['status'].items()])
+    metric('http_retries', 'HTTP requests to NetBox that were retried.', [({}, report['http']['retries'])])
+    metric('http_received_bytes', 'Response bytes received from NetBox.', [({}, report['http']['bytes_received'])])
+    metric('http_request_duration_seconds', 'Latency of HTTP requests to NetBox.',
+           [({'quantile': q}, report['http']['latency_seconds'][key]) for q, key in (('0.5', 'p50'), ('0.9', 'p90'), ('0.99', 'p99'), ('1', 'max'))])
+    metric('geocode_lookups', 'Geocoding lookups by direction and result (memory_hits, cache_hits, misses, errors).',
+           [(dict(scope, direction=name.split('_', 1)[0], result=name.split('_', 1)[1]), n) for scope, data in scopes for name, n in data['geocoding'].items()])
+    metric('objects', 'Objects collected from NetBox and written to the GRENML output.',
+           [(dict(scope, kind=kind), n) for scope, data in scopes for kind, n in data['objects'].items()])
+    return lines
+
+def write_report(success):
+    """Writes REPORT_FILE and REPORT_PROMETHEUS_FILE (each replaced atomically)."""
+    if not REPORT_FILE and not REPORT_PROMETHEUS_FILE:
+        return
+    report = METRICS.report(success)
+    for path, content in ((REPORT_FILE, lambda: json.dumps(report, indent=2)),
+                          (REPORT_PROMETHEUS_FILE, lambda: '\n'.join(prometheus_lines(report)) + '\n')):
+        if not path: continue
+        try:
+            with open(path + '.tmp', 'w', encoding='utf-8') as f:
+                f.write(content())
+            os.replace(path + '.tmp', path)
+        except OSError as e:
+            print(f"WARNING: Could not write run report '{path}': {e}")
+
+_geolocator = None
+_gazetteer = None
+_geocode_db = None
+_geocode_db_lock = threading.Lock()
+
+def get_geolocator():
+    global _geolocator
+    if _geolocator is None:
+        _geolocator = Nominatim(user_agent="grenml_netbox_converter")
+    return _geolocator
+
+# --- Offline Gazetteer ---
+
+def read_geonames_table(path, column):
+    """First column -> `column` of a tab-separated GeoNames file, skipping '#' comments."""
+    table = {}
+    with open(path, encoding='utf-8') as f:
+        for line in f:
+            fields = line.rstrip('\n').split('\t')
+            if line.startswith('#') or len(fields) <= column: continue
+            table[fields[0]] = fields[column]
+    return table
+
+class Gazetteer:
+    """
+    Cities from a GeoNames-style file (geonameid, name, asciiname, alternatenames, latitude, longitude,
+    feature class, feature code, country code, cc2, admin1 code, ...), indexed on a grid over 3D unit
+    vectors so nearest-city lookups need no network and no special cases at the poles or the antimeridian.
+    With numpy, whole batches are compared against every city instead and the grid is not built.
+    """
+    # Grid cell edge as a chord of the unit sphere (about 127 km on the Earth's surface)
+    CELL = 0.02
+    # Size of the point x city distance matrix computed at once with numpy
+    CHUNK_ELEMENTS = 1 << 22
+
+    def __init__(self, path, admin1_path=None, country_path=None):
+        admin1 = read_geonames_table(admin1_path, 1) if admin1_path else {}
+        countries = read_geonames_table(country_path, 4) if country_path else {}
+        self.lat, self.lon, self.names, self.labels, vectors = [], [], [], [], []
+        self.cells, self._shell_offsets = defaultdict(list), []
+        build_grid = np is None
+        with open(path, encoding='utf-8') as f:
+            for line in f:
+                fields = line.rstrip('\n').split('\t')
+                if line.startswith('#') or len(fields) < 11: continue
+                try:
+                    lat, lon = float(fields[4]), float(fields[5])
+                except ValueError:
+                    continue
+                name, country = fields[1], fields[8]
+                if build_grid:
+                    vector = self.vector(lat, lon)
+                    self.cells[self.cell(vector)].append(len(vectors))
+                    vectors.append(vector)
+                self.lat.append(lat)
+                self.lon.append(lon)
+                self.names.append(name)
+                self.labels.append(", ".join(filter(None, [name, admin1.get(f"{country}.{fields[10]}"), countries.get(country, country)])))
+        if not self.lat:
+            raise ValueError(f"No cities found in gazetteer '{path}'")
+        self.vectors = vectors if build_grid else self.unit_vectors(self.lat, self.lon)
+        print(f"Gazetteer loaded: {len(self.lat)} cities from '{path}'.")
+
+    @staticmethod
+    def unit_vectors(lat, lon):
+        """numpy version of vector() for arrays of latitudes and longitudes."""
+        phi, lam = np.radians(np.asarray(lat, dtype=float)), np.radians(np.asarray(lon, dtype=float))
+        return np.stack([np.cos(phi) * np.cos(lam), np.cos(phi) * np.sin(lam), np.sin(phi)], axis=1)
+
+    @staticmethod
+    def vector(lat, lon):
+        phi, lam = math.radians(lat), math.radians(lon)
+        return (math.cos(phi) * math.cos(lam), math.cos(phi) * math.sin(lam), math.sin(phi))
+
+    def cell(self, vector):
+        return tuple(math.floor(c / self.CELL) for c in vector)
+
+    def shell(self, cell, r):
+        """Grid cells at Chebyshev distance r from `cell`."""
+        if r >= len(self._shell_offsets):
+            self._shell_offsets.extend([None] * (r + 1 - len(self._shell_offsets)))
+        if self._shell_offsets[r] is None:
+            self._shell_offsets[r] = [
+                (dx, dy, dz)
+                for dx in range(-r, r + 1) for dy in range(-r, r + 1)
+                for dz in (range(-r, r + 1) if r in (abs(dx), abs(dy)) else ((-r, r) if r else (0,)))
+            ]
+        cx, cy, cz = cell
+        return [(cx + dx, cy + dy, cz + dz) for dx, dy, dz in self._shell_offsets[r]]
+
+    def nearest(self, points):
+        """Index of the closest city to each (lat, lon) point."""
+        if np is not None:
+            return self.nearest_numpy(points)
+        return [self.nearest_grid(self.vector(float(lat), float(lon))) for lat, lon in points]
+
+    def nearest_numpy(self, points):
+        """Brute force over every city, a chunk of points at a time; the closest unit vector has the largest dot product."""
+        points = np.array(points, dtype=float).reshape(-1, 2)
+        queries = self.unit_vectors(points[:, 0], points[:, 1])
+        chunk = max(1, self.CHUNK_ELEMENTS // len(self.vectors))
+        results = []
+        for start in range(0, len(queries), chunk):
+            results.extend((queries[start:start + chunk] @ self.vectors.T).argmax(axis=1).tolist())
+        return results
+
+    def nearest_grid(self, q):
+        """Closest city by growing rings of grid cells, or by brute force once the rings hold more cells than there are cities."""
+        cell = self.cell(q)
+        best, best_distance, visited = None, float('inf'), 0
+        for r in range(int(2 / self.CELL) + 2):
+            shell = self.shell(cell, r)
+            visited += len(shell)
+            if visited > len(self.vectors):
+                break
+            candidates = [i for c in shell if c in self.cells for i in self.cells[c]]
+            if candidates:
+                distance, index = min((sum((a - b) ** 2 for a, b in zip(self.vectors[i], q)), i) for i in candidates)
+                if distance < best_distance:
+                    best, best_distance = index, distance
+            # Every city in a cell outside this ring is at least r * CELL away
+            if best is not None and best_distance <= (r * self.CELL) ** 2:
+                return best
+        return min(range(len(self.vectors)), key=lambda i: sum((a - b) ** 2 for a, b in zip(self.vectors[i], q)))
+
+def get_gazetteer():
+    global _gazetteer
+    if _gazetteer is None:
+        _gazetteer = Gazetteer(GAZETTEER_FILE, GAZETTEER_ADMIN1_FILE, GAZETTEER_COUNTRY_FILE)
+    return _gazetteer
+
+def snap_to_gazetteer(points):
+    """
+    Resolves (lat, lon) points to their nearest gazetteer city in one batch. The results fill the reverse and
+    forward geocoding caches exactly like the Nominatim round-trips, so get_location_data reads them unchanged.
+    """
+    points = [point for point in dict.fromkeys(points) if point not in REVERSE_GEOCODE_CACHE]
+    if not points:
+        return
+    gazetteer = get_gazetteer()
+    for point, index in zip(points, gazetteer.nearest(points)):
+        label = gazetteer.labels[index]
+        REVERSE_GEOCODE_CACHE[point] = label
+        GEOCODE_CACHE[label] = (gazetteer.lat[index], gazetteer.lon[index], gazetteer.names[index])
+    METRICS.count('geocoding', 'reverse_offline', len(points))
+
+def get_geocode_db():
+    """Opens the persistent geocoding cache, dropping expired entries."""
+    global _geocode_db
+    if _geocode_db is None and GEOCODE_CACHE_FILE:
+        _geocode_db = sqlite3.connect(GEOCODE_CACHE_FILE, check_same_thread=False)
+        _geocode_db.execute(
+            "CREATE TABLE IF NOT EXISTS geocode_cache ("
+            "kind TEXT NOT NULL, key TEXT NOT NULL, value TEXT, expires_at REAL NOT NULL, last_used REAL NOT NULL, "
+            "PRIMARY KEY (kind, key))"
+        )
+        _geocode_db.execute("CREATE INDEX IF NOT EXISTS geocode_cache_last_used ON geocode_cache (last_used)")
+        _geocode_db.execute("DELETE FROM geocode_cache WHERE expires_at < ?", (time.time(),))
+        _geocode_db.commit()
+    return _geocode_db
+
+def geocode_cache_get(kind, key):
+    """Returns (found, value) from the persistent cache; value is None for cached 'not found' results."""
+    db = get_geocode_db()
+    if db is None:
+        return False, None
+    with _geocode_db_lock:
+        now = time.time()
+        row = db.execute("SELECT value FROM geocode_cache WHERE kind = ? AND key = ? AND expires_at >= ?", (kind, key, now)).fetchone()
+        if row is None:
+            return False, None
+        db.execute("UPDATE geocode_cache SET last_used = ? WHERE kind = ? AND key = ?", (now, kind, key))
+    return True, json.loads(row[0]) if row[0] is not None else None
+
+def geocode_cache_put(kind, key, value):
+    db = get_geocode_db()
+    if db is None:
+        return
+    ttl = GEOCODE_CACHE_TTL if value is not None else GEOCODE_CACHE_NEGATIVE_TTL
+    with _geocode_db_lock:
+        now = time.time()
+        db.execute(
+            "INSERT OR REPLACE INTO geocode_cache (kind, key, value, expires_at, last_used) VALUES (?, ?, ?, ?, ?)",
+            (kind, key, json.dumps(value) if value is not None else None, now + ttl, now)
+        )
+        # Committed right away: every result cost a rate-limited Nominatim request
+        db.commit()
+
+def close_geocode_cache():
+    """Evicts least recently used entries above GEOCODE_CACHE_MAX_ENTRIES and commits the cache."""
+    global _geocode_db
+    if _geocode_db is None:
+        return
+    with _geocode_db_lock:
+        _geocode_db.execute(
+            "DELETE FROM geocode_cache WHERE rowid IN (SELECT rowid FROM geocode_cache ORDER BY last_used DESC LIMIT -1 OFFSET ?)",
+            (GEOCODE_CACHE_MAX_ENTRIES,)
+        )
+        _geocode_db.commit()
+        _geocode_db.close()
+        _geocode_db = None
+
 def geocode_from_description(description_text):
-    geolocator = Nominatim(user_agent="grenml_netbox_converter")
     if description_text in GEOCODE_CACHE:
+        METRICS.count('geocoding', 'forward_memory_hits')
         return GEOCODE_CACHE[description_text]
+    found, cached = geocode_cache_get('forward', description_text)
+    if found:
+        METRICS.count('geocoding', 'forward_cache_hits')
+        result = tuple(cached) if cached else (None, None, None)
+        GEOCODE_CACHE[description_text] = result
+        return result
+    METRICS.count('geocoding', 'forward_misses')
     try:
-        location = geolocator.geocode(description_text, addressdetails=True)
-        if location:
-            city = location.raw.get('address', {}).get('city', location.raw.get('address', {}).get('town'))
-            result = (location.latitude, location.longitude, city)
-            GEOCODE_CACHE[description_text] = result
-            return result
+        location = get_geolocator().geocode(description_text, addressdetails=True)
     except Exception as e:
+        # Errors are not cached, so the next lookup (or the next build in SERVICE_MODE) tries again
+        METRICS.count('geocoding', 'forward_errors')
         print(f"Geocoding Error: {e}")
+        return (None, None, None)
+    if location:
+        city = location.raw.get('address', {}).get('city', location.raw.get('address', {}).get('town'))
+        result = (location.latitude, location.longitude, city)
+        GEOCODE_CACHE[description_text] = result
+        geocode_cache_put('forward', description_text, list(result))
+        return result
+    geocode_cache_put('forward', description_text, None)
     GEOCODE_CACHE[description_text] = (None, None, None)
     return (None, None, None)
 
 def reverse_geocode(lat, lon):
-    geolocator = Nominatim(user_agent="grenml_netbox_converter_reverse")
     cache_key = (lat, lon)
     if cache_key in REVERSE_GEOCODE_CACHE:
+        METRICS.count('geocoding', 'reverse_memory_hits')
+        return REVERSE_GEOCODE_CACHE[cache_key]
+    if GAZETTEER_FILE:
+        snap_to_gazetteer([cache_key])
         return REVERSE_GEOCODE_CACHE[cache_key]
+    db_key = f"{float(lat):.6f},{float(lon):.6f}"
+    found, cached = geocode_cache_get('reverse', db_key)
+    if found:
+        METRICS.count('geocoding', 'reverse_cache_hits')
+        REVERSE_GEOCODE_CACHE[cache_key] = cached
+        return cached
+    METRICS.count('geocoding', 'reverse_misses')
     try:
-        location = geolocator.reverse((lat, lon), addressdetails=True, language='en')
-        if location and location.raw.get('address'):
-            address = location.raw.get('address', {})
-            city = address.get('city', address.get('town', address.get('village')))
-            state = address.get('state')
-            country = address.get('country')
-            anon_address_string = ", ".join(filter(None, [city, state, country]))
-            if anon_address_string:
-                REVERSE_GEOCODE_CACHE[cache_key] = anon_address_string
-                return anon_address_string
+        location = get_geolocator().reverse((lat, lon), addressdetails=True, language='en')
     except Exception as e:
+        METRICS.count('geocoding', 'reverse_errors')
         print(f"Reverse Geocoding Error: {e}")
+        return None
+    if location and location.raw.get('address'):
+        address = location.raw.get('address', {})
+        city = address.get('city', address.get('town', address.get('village')))
+        state = address.get('state')
+        country = address.get('country')
+        anon_address_string = ", ".join(filter(None, [city, state, country]))
+        if anon_address_string:
+            REVERSE_GEOCODE_CACHE[cache_key] = anon_address_string
+            geocode_cache_put('reverse', db_key, anon_address_string)
+            return anon_address_string
+    geocode_cache_put('reverse', db_key, None)
     REVERSE_GEOCODE_CACHE[cache_key] = None
     return None
 
-def get_location_data(device, sites_map, anonymize=False):
-    location_obj = device.get('location') 
+def get_original_coordinates(device, sites_map):
     site_minimal = device.get('site')
     site_full = None
     if site_minimal and site_minimal.get('id') in sites_map:
         site_full = sites_map.get(site_minimal.get('id'))
-    
-    original_lat, original_lon = None, None
+
     original_lat = device.get('latitude') 
     original_lon = device.get('longitude') 
 
@@ -179,6 +1439,28 @@ def get_location_data(device, sites_map, anonymize=False):
                 if lat_geo:
                     original_lat, original_lon = lat_geo, lon_geo
                     break 
+    return original_lat, original_lon
+
+def prefetch_locations(devices, sites_map, anonymize=False):
+    """Resolves each distinct site address and coordinate pair once, before the node pass reads them from cache."""
+    coordinates = {}
+    for device in devices:
+        lat, lon = get_original_coordinates(device, sites_map)
+        if lat is not None:
+            coordinates[(lat, lon)] = None
+    if anonymize:
+        if GAZETTEER_FILE:
+            snap_to_gazetteer(list(coordinates))
+        for lat, lon in coordinates:
+            anonymized_address_string = reverse_geocode(lat, lon)
+            if anonymized_address_string:
+                geocode_from_description(anonymized_address_string)
+    print(f"Locations resolved: {len(coordinates)} distinct coordinates for {len(devices)} nodes.")
+
+def get_location_data(device, sites_map, anonymize=False):
+    location_obj = device.get('location') 
+    site_minimal = device.get('site')
+    original_lat, original_lon = get_original_coordinates(device, sites_map)
     
     if original_lat is None:
         return 0, 0, None 
@@ -196,7 +1478,10 @@ def get_location_data(device, sites_map, anonymize=False):
         final_adr = ", ".join(filter(None, adr_parts))
         return original_lat, original_lon, (final_adr if final_adr else None)
 
-def populate_additional_properties(node, device_data, ignored_keys, anonymize=False, exceptions=set(), anonymize_ips=False, ip_counter=None):
+# Device keys holding IP address objects, each replaced through the ip_map of 'keyed' anonymization
+ANONYMIZED_IP_KEYS = ('primary_ip', 'primary_ip4', 'primary_ip6', 'oob_ip')
+
+def populate_additional_properties(node, device_data, ignored_keys, anonymize=False, exceptions=set(), anonymize_ips=False, ip_counter=None, ip_map=None):
     anonymized_ip_address = None
     if anonymize_ips and ip_counter and (device_data.get('primary_ip') or device_data.get('primary_ip4')):
         ip_base = f"192.168.{ip_counter[0]}.{ip_counter[1]}"
@@ -216,19 +1501,12 @@ def populate_additional_properties(node, device_data, ignored_keys, anonymize=Fa
         if key in ignored_keys or value in [None, {}, []]: continue
         if anonymized_ip_address and key in ('primary_ip', 'primary_ip4'):
             value = {'family': 4, 'address': anonymized_ip_address}
+        elif anonymize_ips and ip_map is not None and key in ANONYMIZED_IP_KEYS:
+            value = ip_map.get(value.get('id')) if isinstance(value, dict) else None
+            if value is None: continue
         if anonymize and key not in exceptions: continue
         node.add_property(key, json.dumps(value, ensure_ascii=False) if isinstance(value, (dict, list)) else str(value))
 
-def get_device_from_termination(term):
-    if term.get('object_type') == 'dcim.interface':
-        return term.get('object', {}).get('device', {}).get('id')
-    return None
-
-def get_circuit_term_from_termination(term):
-    if term.get('object_type') == 'circuits.circuittermination':
-        return term.get('object', {}).get('id')
-    return None
-
 def anonymize_termination_data(termination_list, alias_map, counter_state, prefix='if-'):
     if not termination_list: return termination_list
     for term in termination_list:
@@ -241,183 +1519,861 @@ def anonymize_termination_data(termination_list, alias_map, counter_state, prefi
             term['object']['description'] = "" 
     return termination_list
 
-def extract_link_endpoints(cable, aggregate_by_site, aggregate_by_owner, rep_urns_site, dev_site_map, rep_urns_owner, dev_owner_map):
-    try:
-        a_term, b_term = cable['a_terminations'][0], cable['b_terminations'][0]
-        if a_term.get('object_type') != 'dcim.interface' or b_term.get('object_type') != 'dcim.interface':
-            return None, None, None, None
-        dev_a_id, dev_b_id = a_term['object']['device']['id'], b_term['object']['device']['id']
-        link_id = f"urn:netbox:cable:{cable['id']}"
-        link_name = cable.get('display') or f"Cable {cable['id']}"
-
-        if aggregate_by_owner:
-            node_a_urn, node_b_urn = rep_urns_owner.get(dev_owner_map.get(dev_a_id)), rep_urns_owner.get(dev_owner_map.get(dev_b_id))
-        elif aggregate_by_site:
-            node_a_urn, node_b_urn = rep_urns_site.get(dev_site_map.get(dev_a_id)), rep_urns_site.get(dev_site_map.get(dev_b_id))
-        else:
-            node_a_urn, node_b_urn = f"urn:netbox:device:{dev_a_id}", f"urn:netbox:device:{dev_b_id}"
-        return link_id, link_name, node_a_urn, node_b_urn
-    except: return None, None, None, None
+class KeyedAnonymizer:
+    """
+    Replacement IPs and interface aliases derived from an HMAC-SHA256 of the NetBox object id.
+
+    Values only depend on the key and on the set of ids being replaced, never on processing order.
+    Hash collisions are resolved by re-hashing, giving way to the lower object id.
+    """
+
+    def __init__(self, key):
+        if not key:
+            raise ValueError("ANONYMIZATION_KEY must be set when ANONYMIZATION_MODE is 'keyed'")
+        self.key = key.encode()
+
+    def _assign(self, kind, object_ids, space):
+        """Maps each id to a distinct integer in range(space)."""
+        assigned, taken = {}, set()
+        for object_id in sorted(set(object_ids)):
+            attempt = 0
+            while True:
+                digest = hmac.new(self.key, f"{kind}:{object_id}:{attempt}".encode(), hashlib.sha256).digest()
+                value = int.from_bytes(digest[:16], 'big') % space
+                if value not in taken: break
+                attempt += 1
+            taken.add(value)
+            assigned[object_id] = value
+        return assigned
+
+    def addresses(self, ip_objects):
+        """IP address id -> {'family', 'address'} in 10.0.0.0/8 or fd00::/8, keeping the original mask."""
+        by_family = {4: {}, 6: {}}
+        for ip in ip_objects:
+            address = str(ip.get('address') or '')
+            if ip.get('id') is None or not address: continue
+            by_family[6 if ':' in address else 4][ip['id']] = address.partition('/')[2]
+        replacements = {}
+        for family, masks in by_family.items():
+            if family == 4:
+                values = self._assign('ipv4', masks, 2 ** 24 - 2)
+                make = lambda value: ipaddress.IPv4Address((10 << 24) + 1 + value)
+            else:
+                values = self._assign('ipv6', masks, 2 ** 120)
+                make = lambda value: ipaddress.IPv6Address((0xfd << 120) + value)
+            for ip_id, value in values.items():
+                mask = masks[ip_id]
+                replacements[ip_id] = {'family': family, 'address': f"{make(value)}/{mask}" if mask else str(make(value))}
+        return replacements
+
+    def interface_aliases(self, interface_ids, prefix='if-'):
+        """Interface id -> alias such as 'if-3f9a0c12be' (40 bits of the keyed hash)."""
+        return {if_id: f"{prefix}{value:010x}" for if_id, value in self._assign('interface', interface_ids, 2 ** 40).items()}
+
+def device_ip_objects(devices):
+    for device in devices:
+        for key in ANONYMIZED_IP_KEYS:
+            if isinstance(device.get(key), dict):
+                yield device[key]
+
+def cable_interface_ids(cables):
+    for cable in cables:
+        for terminations in (cable.a_terminations, cable.b_terminations):
+            for term in json.loads(terminations) if terminations else []:
+                if term.get('object_type') == 'dcim.interface' and 'object' in term:
+                    yield term['object']['id']
+
+# --- Aggregation ---
+
+class Aggregation:
+    """
+    Groups devices into GRENML nodes by a key. A new aggregation level is a subclass
+    defining key() (and optionally urn() and name()) plus an entry in AGGREGATIONS.
+    """
+    level = None
+    # Circuits that cannot be resolved through cables are attached through their termination sites
+    site_fallback = True
+
+    def key(self, device, sites_map):
+        raise NotImplementedError
+
+    def representative_key(self, device, sites_map):
+        """Key under which the full device dict is kept; the first device of each key represents the node."""
+        return self.key(device, sites_map)
+
+    def device_filter(self, key, device):
+        """NetBox device filter selecting exactly the devices of `key` (TARGETED_COLLECTION), or None when there is none."""
+        return None
+
+    def urn(self, key, representative):
+        return f"urn:netbox:device:{representative['id']}"
+
+    def name(self, key, device, sites_map, tenants):
+        return device.name
+
+class DeviceAggregation(Aggregation):
+    level = 'device'
+    site_fallback = False
+
+    def key(self, device, sites_map):
+        return device.id
+
+    def representative_key(self, device, sites_map):
+        return device.id if is_node_device(device) else None
+
+    def urn(self, key, representative):
+        return f"urn:netbox:device:{key}"
+
+class TenantAggregation(Aggregation):
+    level = 'tenant'
+    def key(self, device, sites_map):
+        return device.owner_urn
+
+    def device_filter(self, key, device):
+        return f"&tenant_id={device.tenant_id or 'null'}"
+
+    def urn(self, key, representative):
+        return key
+
+    def name(self, key, device, sites_map, tenants):
+        return tenants[device.tenant_id]['name'] if device.tenant_id else 'generic-owner'
+
+class SiteAggregation(Aggregation):
+    level = 'site'
+    def key(self, device, sites_map):
+        return device.site_id
+
+    def device_filter(self, key, device):
+        return f"&site_id={key}"
+
+    def name(self, key, device, sites_map, tenants):
+        site = sites_map.get(key)
+        return site.get('name') if site else device.name
+
+class SiteAttributeAggregation(Aggregation):
+    """Groups devices by a nested object of their site (region, site group)."""
+    attribute = None
+
+    def _site_object(self, device, sites_map):
+        return (sites_map.get(device.site_id) or {}).get(self.attribute) or {}
+
+    def key(self, device, sites_map):
+        return self._site_object(device, sites_map).get('id')
+
+    def urn(self, key, representative):
+        return f"urn:netbox:{self.attribute.replace('_', '-')}:{key}"
+
+    def name(self, key, device, sites_map, tenants):
+        site_object = self._site_object(device, sites_map)
+        return site_object.get('name') or site_object.get('display') or str(key)
+
+class RegionAggregation(SiteAttributeAggregation):
+    level = 'region'
+    attribute = 'region'
+
+class SiteGroupAggregation(SiteAttributeAggregation):
+    level = 'site_group'
+    attribute = 'group'
+
+    def urn(self, key, representative):
+        return f"urn:netbox:site-group:{key}"
+
+class CustomFieldAggregation(Aggregation):
+    level = 'custom_field'
+    def key(self, device, sites_map):
+        return device.custom_field
+
+    def urn(self, key, representative):
+        return f"urn:netbox:custom-field:{AGGREGATE_CUSTOM_FIELD}:{quote(str(key), safe='')}"
+
+    def name(self, key, device, sites_map, tenants):
+        return str(key)
+
+AGGREGATIONS = {
+    'device': DeviceAggregation,
+    'tenant': TenantAggregation,
+    'site': SiteAggregation,
+    'region': RegionAggregation,
+    'site_group': SiteGroupAggregation,
+    'custom_field': CustomFieldAggregation,
+}
+
+def get_aggregation():
+    level = AGGREGATE_BY or ('tenant' if AGGREGATE_BY_OWNER else 'site' if AGGREGATE_BY_SITE else 'device')
+    if level == 'custom_field' and not AGGREGATE_CUSTOM_FIELD:
+        raise ValueError("AGGREGATE_CUSTOM_FIELD must be set when AGGREGATE_BY is 'custom_field'")
+    return AGGREGATIONS[level]()
+
+# --- Topology Index ---
+
+class TopologyIndex:
+    """
+    Nodes, a device -> node mapping and a deduplicated edge table, built with one pass over
+    devices, one over cables and one over circuits.
+
+    Nodes are numbered in the order their first node device appears. Edges are keyed by the
+    (lower, higher) node number pair and keep the first cable, then the first unresolved circuit,
+    joining two nodes. Circuits resolved through cables on both sides only mark their nodes as
+    linked, exactly like device-to-device cables that repeat an existing edge.
+    """
+
+    def __init__(self, aggregation, devices_index, cable_records, circuits, sites_map):
+        device_records, _, representatives = devices_index
+        self.node_keys, self.node_devices, self.node_representatives = [], [], []
+        node_of_key, site_to_key = {}, {}
+        for device in device_records:
+            if not is_node_device(device): continue
+            key = aggregation.key(device, sites_map)
+            if key is None: continue
+            if device.site_id: site_to_key[device.site_id] = key
+            if key not in node_of_key:
+                node_of_key[key] = len(self.node_keys)
+                self.node_keys.append(key)
+                self.node_devices.append(device)
+                self.node_representatives.append(representatives[(aggregation.level, key)])
+
+        self.device_node = {}
+        for device in device_records:
+            node = node_of_key.get(aggregation.key(device, sites_map))
+            if node is not None: self.device_node[device.id] = node
+
+        self.edges, self.linked = {}, set()
+        circuit_term_to_device = {}
+        for cable in cable_records:
+            d_a, d_b, c_a, c_b = cable.a_device, cable.b_device, cable.a_circuit_term, cable.b_circuit_term
+            if d_a and d_b: self._connect(self.device_node.get(d_a), self.device_node.get(d_b), ('cable', cable))
+            elif d_a and c_b: circuit_term_to_device[c_b] = d_a
+            elif c_a and d_b: circuit_term_to_device[c_a] = d_b
+
+        for circuit in circuits:
+            try:
+                d_a, d_b = circuit_term_to_device.get(circuit['termination_a']['id']), circuit_term_to_device.get(circuit['termination_z']['id'])
+                if d_a and d_b:
+                    self._connect(self.device_node.get(d_a), self.device_node.get(d_b), None)
+                elif aggregation.site_fallback:
+                    s_a, s_z = circuit['termination_a']['site']['id'], circuit['termination_z']['site']['id']
+                    self._connect(node_of_key.get(site_to_key.get(s_a)), node_of_key.get(site_to_key.get(s_z)), ('circuit', circuit))
+            except: continue
+
+    def _connect(self, n_a, n_b, edge):
+        if n_a is None or n_b is None or n_a == n_b: return
+        self.linked.update((n_a, n_b))
+        pair = (n_a, n_b) if n_a < n_b else (n_b, n_a)
+        if edge is not None and pair not in self.edges:
+            self.edges[pair] = edge
+
+# --- Output ---
+
+def open_output(path, compress=False):
+    return gzip.open(path, 'wt', encoding='utf-8') if compress else open(path, 'w', encoding='utf-8')
+
+# grenml's Link.nodes, Link.owners and Node.owners look their IDs up by scanning every node or institution
+# of the topology, which makes its writers quadratic. These writers read the IDs stored on the element; the
+# topology is validated before writing, so every one of them exists.
+
+class DirectLinkWriter(LinkWriter):
+    def write_element(self, link):
+        self.startElement('grenml:Link', {'id': link.id, 'version': link.version})
+        self.element('grenml:name', link.name)
+        self.element('grenml:short-name', link.short_name)
+        for owner in link._owners:
+            self.element('grenml:owner', owner)
+        LifetimeWriter(self.stream).write_element(link)
+        self.write_properties(link.additional_properties)
+        for node in link._nodes:
+            self.element('grenml:node', node)
+        self.endElement('grenml:Link')
+
+class DirectNodeWriter(NodeWriter):
+    def write_element(self, node):
+        self.startElement('grenml:Node', {'id': node.id, 'version': node.version})
+        self.element('grenml:name', node.name)
+        self.element('grenml:short-name', node.short_name)
+        for owner in node._owners:
+            self.element('grenml:owner', owner)
+        LifetimeWriter(self.stream).write_element(node)
+        LocationWriter(self.stream).write_element(node)
+        self.write_properties(node.additional_properties)
+        self.endElement('grenml:Node')
+
+class ParentIdentityValidator(TopologyValidator):
+    """
+    TopologyValidator that checks each element's parent topology by identity. The stock check compares
+    topologies with GRENMLObject.__eq__, node by node, so validating every element was quadratic.
+    """
+
+    def _validate_object_defaults(self, grenml_object, parent):
+        errors = []
+        if grenml_object._parent is not parent:
+            errors.append(f"{grenml_object.__class__.__name__} {grenml_object.id} parent does not match the topology it is in.")
+        # The remaining checks only read the element itself; without a parent their own comparison is trivial
+        own_parent, grenml_object._parent = grenml_object._parent, None
+        try:
+            return errors + super()._validate_object_defaults(grenml_object, None)
+        finally:
+            grenml_object._parent = own_parent
+
+def write_topology_header(stream, topology):
+    """Opens the document and writes the topology's own elements and its institutions."""
+    writer = Writer(stream)
+    writer.startDocument()
+    writer.startElement('grenml:Topology', {
+        'id': topology.id,
+        'version': topology.version,
+        'xmlns:grenml': GRENML_XMLNS_URI,
+        'xmlns:nml': NML_XMLNS_URI,
+        'xmlns:xsi': XSI_XMLNS_URI,
+        'xsi:schemaLocation': XSI_SCHEMA_LOCATION,
+    })
+    writer.element('grenml:name', topology.name)
+    writer.element('grenml:owner', topology.primary_owner)
+    writer.write_properties(topology.additional_properties)
+    for institution in topology.institutions:
+        if not institution.id == 'global':
+            InstitutionWriter(stream).write_element(institution)
+
+def write_topology(stream, topology):
+    """Writes the same document as GRENMLManager.write_to_string() (which has no sub-topologies here), with the direct writers."""
+    write_topology_header(stream, topology)
+    for link in topology.links:
+        DirectLinkWriter(stream).write_element(link)
+    for node in topology.nodes:
+        DirectNodeWriter(stream).write_element(node)
+    Writer(stream).endElement('grenml:Topology')
+
+class StreamingGRENMLManager(GRENMLManager):
+    """
+    GRENMLManager that writes each link to the output file when it is added instead of keeping it.
+
+    Institutions and nodes stay in memory, since links refer to them. The document keeps the
+    element order of write_to_string(): institutions are written before the first link and
+    nodes are written by close(). Each link is validated before it is written and the file
+    only replaces `path` once the document is complete.
+    """
+
+    def __init__(self, path, name=None, compress=False):
+        super().__init__(name=name, validator=ParentIdentityValidator())
+        self.path = path
+        self._tmp_path = path + '.tmp'
+        self._stream = open_output(self._tmp_path, compress)
+        self._header_written = False
+        self._link_ids = set()
+
+    def add_institution(self, *args, **kwargs):
+        if self._header_written:
+            raise ValueError('Institutions must be added before the first link is written')
+        return super().add_institution(*args, **kwargs)
+
+    def _write_header(self):
+        self.validate()
+        write_topology_header(self._stream, self.topology)
+        self._header_written = True
+
+    def add_link(self, *args, **kwargs):
+        if not self._header_written:
+            self._write_header()
+        link_id = super().add_link(*args, **kwargs)
+        # The topology only ever holds the link being written
+        link = self.topology.links.pop()
+        if link_id in self._link_ids:
+            raise AttributeIdError(f'Link ID: {link_id} must be unique')
+        errors = self._validator._validate_link(link, self.topology)
+        if errors:
+            raise ValueError('\n'.join(errors))
+        DirectLinkWriter(self._stream).write_element(link)
+        self._link_ids.add(link_id)
+        return link_id
+
+    def close(self):
+        if not self._header_written:
+            self._write_header()
+        self.validate()
+        for node in self.topology.nodes:
+            DirectNodeWriter(self._stream).write_element(node)
+        Writer(self._stream).endElement('grenml:Topology')
+        self._stream.close()
+        os.replace(self._tmp_path, self.path)
+
+    def discard(self):
+        self._stream.close()
+        if os.path.exists(self._tmp_path):
+            os.remove(self._tmp_path)
 
 # ====================================================================
 # 4. PROCESSING
 # ====================================================================
 
-manager = GRENMLManager(name="NetBox Topology")
-generic_owner_id = "urn:org:generic-owner1"
-device_to_site_map, device_to_owner_map, all_tenants_data_map = {}, {}, {}
-
-for device in all_devices_data.get('results', []):
-    dev_id = device.get('id')
-    if not dev_id: continue
-    site_id = device.get('site', {}).get('id')
-    tenant_id = device.get('tenant', {}).get('id')
-    if site_id: device_to_site_map[dev_id] = site_id
-    if tenant_id:
-        device_to_owner_map[dev_id] = f"urn:netbox:tenant:{tenant_id}"
-        all_tenants_data_map[tenant_id] = device['tenant']
-    else: device_to_owner_map[dev_id] = generic_owner_id
-
-rnp_owner = Institution(id=generic_owner_id, name='generic-owner')
-manager.add_institution(rnp_owner, primary_owner=True)
-institutions_by_urn_map = {rnp_owner.id: rnp_owner}
-tenant_institutions_map = {}
-
-for t_id, t_data in all_tenants_data_map.items():
-    urn = f"urn:netbox:tenant:{t_id}"
-    inst = Institution(id=urn, name=t_data['name'])
-    manager.add_institution(inst)
-    tenant_institutions_map[t_id] = institutions_by_urn_map[urn] = inst
-
-circuit_termination_to_device_map, device_links, resolved_circuits_ids = {}, [], set()
-for cable in cables_data.get('results', []):
-    try:
-        t_a, t_b = cable['a_terminations'][0], cable['b_terminations'][0]
-        d_a, d_b = get_device_from_termination(t_a), get_device_from_termination(t_b)
-        c_a, c_b = get_circuit_term_from_termination(t_a), get_circuit_term_from_termination(t_b)
-        if d_a and d_b: device_links.append((d_a, d_b, cable))
-        elif d_a and c_b: circuit_termination_to_device_map[c_b] = d_a
-        elif c_a and d_b: circuit_termination_to_device_map[c_a] = d_b
-    except: continue
-
-for circuit in circuits_data.get('results', []):
+def collect_data(aggregations, datasets=None):
+    """
+    Fetches (or replays) the NetBox data once for the given aggregations:
+    returns (devices_index, cable_records, sites_map, circuits).
+    Already fetched `datasets` (full devices, cables, sites and circuits results) are only compacted.
+    """
+    with METRICS.stage('collection'):
+        if datasets is not None:
+            devices_index, cable_records, sites_map, circuits = data = compact_datasets(datasets, aggregations)
+        else:
+            devices_index, cable_records, sites_map, circuits = data = _collect_data(aggregations)
+    METRICS.set_objects(devices=len(devices_index[0]), tenants=len(devices_index[1]), cables=len(cable_records), sites=len(sites_map), circuits=len(circuits))
+    return data
+
+def _collect_data(aggregations):
+    if SNAPSHOT_MODE == 'replay':
+        return replay_snapshot(aggregations)
+    if COLLECTION_BACKEND not in ('rest', 'graphql'):
+        raise ValueError("COLLECTION_BACKEND must be 'rest' or 'graphql'")
+    if COLLECTION_BACKEND == 'graphql' and INCREMENTAL_SYNC:
+        raise ValueError("INCREMENTAL_SYNC requires the 'rest' COLLECTION_BACKEND")
+    if TARGETED_COLLECTION and (COLLECTION_BACKEND != 'rest' or INCREMENTAL_SYNC):
+        raise ValueError("TARGETED_COLLECTION requires the 'rest' COLLECTION_BACKEND and no INCREMENTAL_SYNC")
+    credentials, data_number, headers = getCredentials()
+    snapshot = SnapshotWriter(SNAPSHOT_FILE, int(data_number)) if SNAPSHOT_MODE == 'save' else None
+    if TARGETED_COLLECTION:
+        data = collect_targeted(data_number, headers, aggregations, snapshot)
+    elif STREAM_PAGES and not INCREMENTAL_SYNC:
+        devices_index, cable_records, sites_data, circuits_data = collect_streaming(data_number, headers, aggregations, snapshot)
+        sites_map = {site['id']: site for site in sites_data.get('results', [])}
+        data = devices_index, cable_records, sites_map, circuits_data.get('results', [])
+    else:
+        if INCREMENTAL_SYNC:
+            datasets = collect_incremental(data_number, headers)
+        else:
+            datasets = collect_all(data_number, headers)
+        if snapshot:
+            for key, dataset in zip(SNAPSHOT_KEYS, datasets):
+                snapshot.write_results(key, dataset.get('results', []))
+        data = compact_datasets(datasets, aggregations)
+    if snapshot:
+        snapshot.close()
+    return data
+
+def compact_datasets(datasets, aggregations):
+    """Compacts full devices, cables, sites and circuits results (in SNAPSHOT_KEYS order)."""
+    devices_data, cables_data, sites_data, circuits_data = datasets
+    sites_map = {site['id']: site for site in sites_data.get('results', [])}
+    devices_index = compact_devices([devices_data.get('results', [])], aggregations, sites_map)
+    cable_records = compact_cables([cables_data.get('results', [])])
+    return devices_index, cable_records, sites_map, circuits_data.get('results', [])
+
+def build_grenml(manager, aggregation, devices_index, cable_records, sites_map, circuits):
+    """Adds the institutions, nodes and links of the topology to `manager`."""
+    all_tenants_data_map = devices_index[1]
+
+    rnp_owner = Institution(id=generic_owner_id, name='generic-owner')
+    manager.add_institution(rnp_owner, primary_owner=True)
+    tenant_institutions_map = {}
+
+    for t_id, t_data in all_tenants_data_map.items():
+        inst = Institution(id=f"urn:netbox:tenant:{t_id}", name=t_data['name'])
+        manager.add_institution(inst)
+        tenant_institutions_map[t_id] = inst
+
+    def device_owners(device):
+        return [rnp_owner] + ([tenant_institutions_map[device.tenant_id]] if device.tenant_id in tenant_institutions_map else [])
+
+    topology_index = TopologyIndex(aggregation, devices_index, cable_records, circuits, sites_map)
+    if_alias_map, if_alias_counter, ip_anonymization_counter, ip_map = {}, [1], [1, 1], None
+    if ANONYMIZATION_MODE == 'keyed':
+        # Every replacement is computed up front, so the node and link passes below do not depend on order
+        anonymizer, ip_anonymization_counter = KeyedAnonymizer(ANONYMIZATION_KEY), None
+        if ANONYMIZE_IPS:
+            ip_map = anonymizer.addresses(device_ip_objects(topology_index.node_representatives))
+        if ANONYMIZE_INTERFACES:
+            cables = (item for kind, item in topology_index.edges.values() if kind == 'cable')
+            if_alias_map = anonymizer.interface_aliases(cable_interface_ids(cables), ANONYMIZE_INTERFACE_PREFIX)
+    elif ANONYMIZATION_MODE != 'sequential':
+        raise ValueError("ANONYMIZATION_MODE must be 'sequential' or 'keyed'")
+
+    # Lookups are committed as they are made; closing evicts old entries, also when a lookup fails
     try:
-        d_a, d_b = circuit_termination_to_device_map.get(circuit['termination_a']['id']), circuit_termination_to_device_map.get(circuit['termination_z']['id'])
-        if d_a and d_b: device_links.append((d_a, d_b, circuit)); resolved_circuits_ids.add(circuit['id'])
-    except: continue
-
-processed_nodes_map, representative_devices_site, representative_device_urns_site = {}, {}, {}
-representative_devices_owner, representative_device_urns_owner, site_to_owner_urn_map = {}, {}, {}
-if_alias_map, if_alias_counter, ip_anonymization_counter = {}, [1], [1, 1]
-
-devices_to_process = [d for d in all_devices_data.get('results', []) if d.get('role', {}).get('slug') == 'gp4l-node' and d.get('status', {}).get('value') == 'active']
-
-if AGGREGATE_BY_OWNER:
-    for device in all_devices_data.get('results', []):
-        urn = device_to_owner_map.get(device['id'], generic_owner_id)
-        if urn not in representative_devices_owner:
-            representative_devices_owner[urn] = device
-            representative_device_urns_owner[urn] = urn
-    for device in devices_to_process:
-        urn = device_to_owner_map.get(device['id'], generic_owner_id)
-        site_id = device_to_site_map.get(device['id'])
-        if site_id: site_to_owner_urn_map[site_id] = urn
-        if urn not in processed_nodes_map:
-            inst = institutions_by_urn_map.get(urn)
-            rep = representative_devices_owner[urn]
-            lat, lon, adr = get_location_data(rep, sites_map, ANONYMIZE_LOCATION)
-            owners = [rnp_owner] + ([inst] if inst != rnp_owner else [])
-            node = Node(id=urn, name=inst.name, short_name=inst.name, latitude=lat, longitude=lon, address=adr, owners=owners)
-            processed_nodes_map[urn] = (node, owners)
-            populate_additional_properties(node, rep, HANDLED_KEYS, ANONYMIZE_FIELDS, ANONYMIZATION_EXCEPTIONS, ANONYMIZE_IPS, ip_anonymization_counter)
-
-elif AGGREGATE_BY_SITE:
-    for device in all_devices_data.get('results', []):
-        s_id = device.get('site', {}).get('id')
-        if s_id and s_id not in representative_devices_site:
-            representative_devices_site[s_id] = device
-            representative_device_urns_site[s_id] = f"urn:netbox:device:{device['id']}"
-    for device in devices_to_process:
-        s_id = device.get('site', {}).get('id')
-        if s_id:
-            urn = representative_device_urns_site.get(s_id)
-            if urn and urn not in processed_nodes_map:
-                s_full = sites_map.get(s_id)
-                name = s_full.get('name') if s_full else device['name']
-                lat, lon, adr = get_location_data(representative_devices_site[s_id], sites_map, ANONYMIZE_LOCATION)
-                owners = [rnp_owner] + ([tenant_institutions_map[device['tenant']['id']]] if device.get('tenant') and device['tenant']['id'] in tenant_institutions_map else [])
+        with METRICS.stage('locations'):
+            prefetch_locations(topology_index.node_representatives, sites_map, ANONYMIZE_LOCATION)
+        with METRICS.stage('node_pass'):
+            node_entries = []
+            for key, device, rep in zip(topology_index.node_keys, topology_index.node_devices, topology_index.node_representatives):
+                urn, name, owners = aggregation.urn(key, rep), aggregation.name(key, device, sites_map, all_tenants_data_map), device_owners(device)
+                lat, lon, adr = get_location_data(rep, sites_map, ANONYMIZE_LOCATION)
                 node = Node(id=urn, name=name, short_name=name, latitude=lat, longitude=lon, address=adr, owners=owners)
-                processed_nodes_map[urn] = (node, owners)
-                populate_additional_properties(node, representative_devices_site[s_id], HANDLED_KEYS, ANONYMIZE_FIELDS, ANONYMIZATION_EXCEPTIONS, ANONYMIZE_IPS, ip_anonymization_counter)
-else:
-    for device in devices_to_process:
-        urn = f"urn:netbox:device:{device['id']}"
-        lat, lon, adr = get_location_data(device, sites_map, ANONYMIZE_LOCATION)
-        owners = [rnp_owner] + ([tenant_institutions_map[device['tenant']['id']]] if device.get('tenant') and device['tenant']['id'] in tenant_institutions_map else [])
-        node = Node(id=urn, name=device['name'], short_name=device['name'], latitude=lat, longitude=lon, address=adr, owners=owners)
-        processed_nodes_map[urn] = (node, owners)
-        populate_additional_properties(node, device, HANDLED_KEYS, ANONYMIZE_FIELDS, ANONYMIZATION_EXCEPTIONS, ANONYMIZE_IPS, ip_anonymization_counter)
-
-linked_node_urns = set()
-for d_a, d_b, _ in device_links:
-    if AGGREGATE_BY_OWNER: n_a, n_b = representative_device_urns_owner.get(device_to_owner_map.get(d_a)), representative_device_urns_owner.get(device_to_owner_map.get(d_b))
-    elif AGGREGATE_BY_SITE: n_a, n_b = representative_device_urns_site.get(device_to_site_map.get(d_a)), representative_device_urns_site.get(device_to_site_map.get(d_b))
-    else: n_a, n_b = f"urn:netbox:device:{d_a}", f"urn:netbox:device:{d_b}"
-    if n_a in processed_nodes_map and n_b in processed_nodes_map and n_a != n_b: linked_node_urns.update([n_a, n_b])
-
-if AGGREGATE_BY_OWNER or AGGREGATE_BY_SITE:
-    for circuit in circuits_data['results']:
-        if circuit['id'] in resolved_circuits_ids: continue
+                node_entries.append((node, owners))
+                populate_additional_properties(node, rep, HANDLED_KEYS, ANONYMIZE_FIELDS, ANONYMIZATION_EXCEPTIONS, ANONYMIZE_IPS, ip_anonymization_counter, ip_map)
+
+            for number, (node_obj, _) in enumerate(node_entries):
+                if not REMOVE_UNLINKED_NODES or number in topology_index.linked:
+                    manager.add_node(node_obj)
+    finally:
+        close_geocode_cache()
+
+    with METRICS.stage('link_pass'):
+        for (n_a, n_b), (kind, item) in topology_index.edges.items():
+            (n_a_obj, o_a), (n_b_obj, o_b) = node_entries[n_a], node_entries[n_b]
+            if kind == 'cable':
+                link = Link(id=f"urn:netbox:cable:{item.id}", name=item.name, owners=list(set(o_a) | set(o_b)), nodes=[n_a_obj, n_b_obj])
+                a_t = json.loads(item.a_terminations) if item.a_terminations else None
+                b_t = json.loads(item.b_terminations) if item.b_terminations else None
+                if ANONYMIZE_INTERFACES:
+                    a_t = anonymize_termination_data(a_t, if_alias_map, if_alias_counter, ANONYMIZE_INTERFACE_PREFIX)
+                    b_t = anonymize_termination_data(b_t, if_alias_map, if_alias_counter, ANONYMIZE_INTERFACE_PREFIX)
+                if a_t: link.add_property('a_terminations', json.dumps(a_t))
+                if b_t: link.add_property('b_terminations', json.dumps(b_t))
+            else:
+                owners = [rnp_owner] + ([tenant_institutions_map[item['tenant']['id']]] if item.get('tenant') and item['tenant']['id'] in tenant_institutions_map else [])
+                link = Link(id=f"urn:netbox:circuit:{item['id']}", name=item.get('cid') or f"Link {item['id']}", owners=owners, nodes=[n_a_obj, n_b_obj])
+                if item.get('termination_a'): link.add_property('termination_a', json.dumps(item['termination_a']))
+                if item.get('termination_z'): link.add_property('termination_z', json.dumps(item['termination_z']))
+            manager.add_link(link)
+
+    METRICS.set_objects(nodes=len(manager.topology.nodes), links=len(topology_index.edges), institutions=1 + len(tenant_institutions_map))
+
+def output_path():
+    return OUTPUT_FILE + ('.gz' if OUTPUT_GZIP else '')
+
+def export_grenml(aggregation, data, output_path):
+    """Builds the GRENML document for `data` (as returned by collect_data) and writes it to `output_path`."""
+    compress = output_path.endswith('.gz')
+    if STREAM_OUTPUT:
+        manager = StreamingGRENMLManager(output_path, name="NetBox Topology", compress=compress)
+    else:
+        manager = GRENMLManager(name="NetBox Topology", validator=ParentIdentityValidator())
+    try:
+        build_grenml(manager, aggregation, *data)
+        with METRICS.stage('serialization'):
+            if STREAM_OUTPUT:
+                manager.close()
+            else:
+                manager.validate()
+                with open_output(output_path, compress) as f:
+                    write_topology(f, manager.topology)
+        print(f"\n[SUCCESS] '{output_path}' file saved correctly.")
+        return True
+    except Exception as e:
+        if STREAM_OUTPUT: manager.discard()
+        print(f"\n[ERROR]: {e}")
+    return False
+
+# --- Output Variants ---
+
+@contextmanager
+def variant_flags(overrides):
+    """Temporarily applies a variant's configuration flag overrides to this module."""
+    unknown = [name for name in overrides if not name.isupper() or name not in globals()]
+    if unknown:
+        raise ValueError(f"Unknown configuration flags in variant: {', '.join(unknown)}")
+    previous = {name: globals()[name] for name in overrides}
+    globals().update(overrides)
+    try:
+        yield
+    finally:
+        globals().update(previous)
+
+# Flags read while fetching and compacting the data all variants share; a variant may not override them
+VARIANT_SHARED_FLAGS = {'AGGREGATE_CUSTOM_FIELD', 'COLLECTION_BACKEND', 'GRAPHQL_DEVICE_EXTRA_FIELDS', 'PARALLEL_FETCH', 'STREAM_PAGES'}
+VARIANT_SHARED_PREFIXES = ('FETCH_', 'INCREMENTAL_', 'TARGETED_', 'SNAPSHOT_')
+
+_variant_data = None
+
+def _init_variant_worker(data, geocode_cache, reverse_geocode_cache):
+    global _variant_data
+    _variant_data = data
+    GEOCODE_CACHE.update(geocode_cache)
+    REVERSE_GEOCODE_CACHE.update(reverse_geocode_cache)
+
+def _export_variant(overrides):
+    """Returns whether the variant was written, with the stages, counts and geocoding lookups of this worker."""
+    global METRICS
+    # Forked workers inherit the parent's metrics; each variant reports only its own work
+    METRICS = RunMetrics()
+    with variant_flags(overrides):
+        ok = export_grenml(get_aggregation(), _variant_data, output_path())
+    report = METRICS.report(ok)
+    return ok, {key: report[key] for key in ('success', 'stages', 'geocoding', 'objects')}
+
+def export_variants(variants, collect=collect_data):
+    """
+    Builds one output per variant from a single fetch. Locations for every variant are resolved
+    here first, so the workers share one geocoding cache and never query Nominatim for the same place.
+    `collect` returns the data for a list of aggregations, like collect_data.
+    """
+    output_files = [variant.get('OUTPUT_FILE') for variant in variants]
+    if None in output_files or len(set(output_files)) != len(output_files):
+        raise ValueError("Every variant must set its own OUTPUT_FILE")
+    shared = sorted({name for variant in variants for name in variant if name in VARIANT_SHARED_FLAGS or name.startswith(VARIANT_SHARED_PREFIXES)})
+    if shared:
+        raise ValueError(f"Collection flags are shared by all variants and cannot be overridden: {', '.join(shared)}")
+    aggregations = []
+    for variant in variants:
+        with variant_flags(variant):
+            aggregations.append(get_aggregation())
+
+    devices_index, cable_records, sites_map, circuits = data = collect(list({a.level: a for a in aggregations}.values()))
+    with METRICS.stage('locations'):
         try:
-            s_a, s_z = circuit['termination_a']['site']['id'], circuit['termination_z']['site']['id']
-            if AGGREGATE_BY_OWNER: n_a, n_b = representative_device_urns_owner.get(site_to_owner_urn_map.get(s_a)), representative_device_urns_owner.get(site_to_owner_urn_map.get(s_z))
-            else: n_a, n_b = representative_device_urns_site.get(s_a), representative_device_urns_site.get(s_z)
-            if n_a in processed_nodes_map and n_b in processed_nodes_map and n_a != n_b: linked_node_urns.update([n_a, n_b])
-        except: continue
-
-final_added_nodes_urns = set()
-for urn, (node_obj, _) in processed_nodes_map.items():
-    if not REMOVE_UNLINKED_NODES or urn in linked_node_urns:
-        manager.add_node(node_obj)
-        final_added_nodes_urns.add(urn)
-
-created_links_tracker = set()
-for cable in cables_data['results']:
-    l_id, l_name, n_a, n_b = extract_link_endpoints(cable, AGGREGATE_BY_SITE, AGGREGATE_BY_OWNER, representative_device_urns_site, device_to_site_map, representative_device_urns_owner, device_to_owner_map)
-    if n_a in final_added_nodes_urns and n_b in final_added_nodes_urns and n_a != n_b:
-        key = tuple(sorted([n_a, n_b]))
-        if key not in created_links_tracker:
-            n_a_obj, o_a = processed_nodes_map[n_a]; n_b_obj, o_b = processed_nodes_map[n_b]
-            link = Link(id=l_id, name=l_name, owners=list(set(o_a) | set(o_b)), nodes=[n_a_obj, n_b_obj])
-            a_t, b_t = cable.get('a_terminations'), cable.get('b_terminations')
-            if ANONYMIZE_INTERFACES:
-                a_t = anonymize_termination_data(a_t, if_alias_map, if_alias_counter, ANONYMIZE_INTERFACE_PREFIX)
-                b_t = anonymize_termination_data(b_t, if_alias_map, if_alias_counter, ANONYMIZE_INTERFACE_PREFIX)
-            if a_t: link.add_property('a_terminations', json.dumps(a_t))
-            if b_t: link.add_property('b_terminations', json.dumps(b_t))
-            manager.add_link(link); created_links_tracker.add(key)
-
-if AGGREGATE_BY_OWNER or AGGREGATE_BY_SITE:
-    for circuit in circuits_data['results']:
-        if circuit['id'] in resolved_circuits_ids: continue
+            for variant, aggregation in zip(variants, aggregations):
+                with variant_flags(variant):
+                    topology_index = TopologyIndex(aggregation, devices_index, cable_records, circuits, sites_map)
+                    prefetch_locations(topology_index.node_representatives, sites_map, ANONYMIZE_LOCATION)
+        finally:
+            close_geocode_cache()
+
+    workers = min(len(variants), VARIANT_MAX_WORKERS or os.cpu_count() or 1)
+    print(f"Building {len(variants)} variants with {workers} worker processes.")
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_variant_worker, initargs=(data, GEOCODE_CACHE, REVERSE_GEOCODE_CACHE)) as pool:
+        results = []
+        for output_file, (ok, variant_report) in zip(output_files, pool.map(_export_variant, variants)):
+            METRICS.variants[output_file] = variant_report
+            results.append(ok)
+    for output_file, ok in zip(output_files, results):
+        print(f"  {'OK' if ok else 'FAILED'}: {output_file}")
+    return all(results)
+
+# --- Service Mode ---
+
+# NetBox webhook models and the endpoint they refresh; a circuit termination refreshes its circuit
+WEBHOOK_MODELS = {'device': 'devices', 'cable': 'cables', 'site': 'sites', 'circuit': 'circuits', 'circuittermination': 'circuits'}
+
+# Object IDs per request when refreshing the objects named by webhooks
+SERVICE_FETCH_BATCH = 100
+
+def webhook_target(payload):
+    """(endpoint, object id) to refresh for a NetBox webhook payload, or None for unrelated models."""
+    if not isinstance(payload, dict):
+        return None
+    endpoint, data = WEBHOOK_MODELS.get(payload.get('model')), payload.get('data') or {}
+    if payload.get('model') == 'circuittermination':
+        data = data.get('circuit') or {}
+    if endpoint is None or data.get('id') is None:
+        return None
+    return endpoint, data['id']
+
+def patch_results(results, fetched, requested_ids):
+    """
+    Replaces refreshed objects in place, drops requested IDs that NetBox no longer returns and inserts
+    new objects in ID order, where a full fetch lists them (the first device of a key represents its node).
+    """
+    fetched_by_id = {obj['id']: obj for obj in fetched}
+    patched = [fetched_by_id.pop(obj['id'], obj) for obj in results if obj['id'] not in requested_ids or obj['id'] in fetched_by_id]
+    new = sorted(fetched_by_id.values(), key=itemgetter('id'))
+    merged, position = [], 0
+    for obj in patched:
+        while position < len(new) and new[position]['id'] < obj['id']:
+            merged.append(new[position])
+            position += 1
+        merged.append(obj)
+    return merged + new[position:]
+
+class GRENMLService:
+    """
+    Keeps the fetched NetBox objects and the geocoding caches in memory between builds.
+    Webhooks queue the objects to refresh; the builder thread re-fetches only those objects
+    and rebuilds the outputs once no webhook arrived for SERVICE_DEBOUNCE seconds.
+    """
+
+    def __init__(self):
+        _, self.data_number, self.headers = getCredentials()
+        self.datasets = None
+        self.pending = defaultdict(set)
+        self.first_event = self.last_event = None
+        self.condition = threading.Condition()
+        # Served file name -> (body, ETag, Last-Modified); replaced as a whole after each successful build
+        self.outputs = {}
+        self.last_full_sync = None
+        self.last_build = None
+
+    def queue(self, endpoint, object_id):
+        with self.condition:
+            self.pending[endpoint].add(object_id)
+            self.last_event = time.monotonic()
+            self.first_event = self.first_event or self.last_event
+            self.condition.notify()
+
+    def output_paths(self):
+        paths = []
+        for variant in VARIANTS or [{}]:
+            with variant_flags(variant):
+                paths.append(output_path())
+        return paths
+
+    def full_sync(self):
+        self.datasets = collect_incremental(self.data_number, self.headers) if INCREMENTAL_SYNC else collect_all(self.data_number, self.headers)
+        self.last_full_sync = time.monotonic()
+        # Forget in-memory geocoding results, so they live at most SERVICE_RESYNC_INTERVAL; the
+        # persistent cache still answers them within GEOCODE_CACHE_TTL / GEOCODE_CACHE_NEGATIVE_TTL
+        GEOCODE_CACHE.clear()
+        REVERSE_GEOCODE_CACHE.clear()
+
+    def refresh(self, pending):
+        collectors = dict(zip(SNAPSHOT_KEYS, (getDevices, getCables, getSites, getCircuits)))
+        for index, key in enumerate(SNAPSHOT_KEYS):
+            ids = sorted(pending.get(key, ()))
+            if not ids: continue
+            fetched = []
+            for start in range(0, len(ids), SERVICE_FETCH_BATCH):
+                query = ''.join(f'&id={object_id}' for object_id in ids[start:start + SERVICE_FETCH_BATCH])
+                fetched += collectors[key](self.data_number, self.headers, query)['results']
+            results = patch_results(self.datasets[index]['results'], fetched, set(ids))
+            self.datasets[index] = {'count': len(results), 'results': results}
+            print(f"Refreshed {key}: {len(fetched)} created or updated, {len(ids) - len(fetched)} deleted.")
+
+    def rebuild(self, pending=None):
+        """Refreshes `pending` objects (everything when None), rebuilds the outputs and loads them for serving."""
+        global METRICS
+        METRICS = RunMetrics()
+        success = False
         try:
-            s_a, s_z = circuit['termination_a']['site']['id'], circuit['termination_z']['site']['id']
-            if AGGREGATE_BY_OWNER: n_a, n_b = representative_device_urns_owner.get(site_to_owner_urn_map.get(s_a)), representative_device_urns_owner.get(site_to_owner_urn_map.get(s_z))
-            else: n_a, n_b = representative_device_urns_site.get(s_a), representative_device_urns_site.get(s_z)
-            if n_a in final_added_nodes_urns and n_b in final_added_nodes_urns and n_a != n_b:
-                key = tuple(sorted([n_a, n_b]))
-                if key not in created_links_tracker:
-                    n_a_obj, o_a = processed_nodes_map[n_a]; n_b_obj, o_b = processed_nodes_map[n_b]
-                    owners = [rnp_owner] + ([tenant_institutions_map[circuit['tenant']['id']]] if circuit.get('tenant') and circuit['tenant']['id'] in tenant_institutions_map else [])
-                    link = Link(id=f"urn:netbox:circuit:{circuit['id']}", name=circuit.get('cid') or f"Link {circuit['id']}", owners=owners, nodes=[n_a_obj, n_b_obj])
-                    if circuit.get('termination_a'): link.add_property('termination_a', json.dumps(circuit['termination_a']))
-                    if circuit.get('termination_z'): link.add_property('termination_z', json.dumps(circuit['termination_z']))
-                    manager.add_link(link); created_links_tracker.add(key)
-        except: continue
+            with METRICS.stage('refresh'):
+                if pending is None:
+                    self.full_sync()
+                else:
+                    self.refresh(pending)
+            collect = lambda aggregations: collect_data(aggregations, self.datasets)
+            if VARIANTS:
+                success = export_variants(VARIANTS, collect)
+            else:
+                aggregation = get_aggregation()
+                success = export_grenml(aggregation, collect([aggregation]), output_path())
+            if success:
+                self.load_outputs()
+        finally:
+            self.last_build = {'finished_at': time.time(), 'success': success}
+            write_report(success)
 
-try:
-    with open("grenml.xml", "w", encoding="utf-8") as f:
-        f.write(manager.write_to_string())
-    print("\n[SUCCESS] 'grenml.xml' file saved correctly.")
-except Exception as e:
-    print(f"\n[ERROR]: {e}")
+    def load_outputs(self):
+        outputs = {}
+        for path in self.output_paths():
+            with open(path, 'rb') as f:
+                body = f.read()
+            previous = self.outputs.get(os.path.basename(path))
+            etag = '"' + hashlib.sha256(body).hexdigest()[:32] + '"'
+            last_modified = previous[2] if previous and previous[1] == etag else formatdate(usegmt=True)
+            outputs[os.path.basename(path)] = (body, etag, last_modified)
+        self.outputs = outputs
+
+    def next_build(self):
+        """Waits for the next build; returns the pending objects to refresh, or None for a full sync."""
+        with self.condition:
+            while True:
+                now = time.monotonic()
+                if self.last_full_sync is None or (SERVICE_RESYNC_INTERVAL and now - self.last_full_sync >= SERVICE_RESYNC_INTERVAL):
+                    pending = None
+                    break
+                if self.pending:
+                    wait = min(self.last_event + SERVICE_DEBOUNCE, self.first_event + SERVICE_DEBOUNCE_MAX) - now
+                    if wait <= 0:
+                        pending = self.pending
+                        break
+                else:
+                    wait = self.last_full_sync + SERVICE_RESYNC_INTERVAL - now if SERVICE_RESYNC_INTERVAL else None
+                self.condition.wait(wait)
+            # A full sync also covers everything queued so far
+            self.pending = defaultdict(set)
+            self.first_event = self.last_event = None
+            return pending
+
+    def run_builds(self):
+        while True:
+            pending = self.next_build()
+            try:
+                self.rebuild(pending)
+            except Exception as e:
+                print(f"[ERROR] Build failed, retrying in {SERVICE_DEBOUNCE}s: {e}")
+                for endpoint, ids in (pending or {}).items():
+                    for object_id in ids:
+                        self.queue(endpoint, object_id)
+                time.sleep(SERVICE_DEBOUNCE)
+
+def make_service_handler(service):
+    class ServiceHandler(BaseHTTPRequestHandler):
+        server_version = 'NetBox2GRENML'
+
+        def log_message(self, format, *args):
+            pass
+
+        def respond(self, status, body=b'', content_type='text/plain; charset=utf-8', headers=()):
+            self.send_response(status)
+            for name, value in headers:
+                self.send_header(name, value)
+            if status != 304:
+                self.send_header('Content-Type', content_type)
+                self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            if self.command != 'HEAD' and status != 304:
+                self.wfile.write(body)
+
+        def do_GET(self):
+            path = urlsplit(self.path).path.strip('/')
+            outputs = service.outputs
+            if path == 'healthz':
+                with service.condition:
+                    pending = sum(len(ids) for ids in service.pending.values())
+                status = {'ready': bool(outputs), 'outputs': list(outputs), 'last_build': service.last_build, 'pending': pending}
+                return self.respond(200, json.dumps(status).encode(), 'application/json')
+            if not outputs:
+                return self.respond(503, b'The first build has not finished yet.\n', headers=[('Retry-After', str(SERVICE_DEBOUNCE))])
+            name = path or next(iter(outputs))
+            entry = outputs.get(name)
+            if entry is None:
+                return self.respond(404, b'Not found.\n')
+            body, etag, last_modified = entry
+            headers = [('ETag', etag), ('Last-Modified', last_modified), ('Cache-Control', 'no-cache')]
+            if_none_match = self.headers.get('If-None-Match')
+            if if_none_match and (if_none_match.strip() == '*' or etag in (tag.strip() for tag in if_none_match.split(','))):
+                return self.respond(304, headers=headers)
+            content_type = 'application/gzip' if name.endswith('.gz') else 'application/xml; charset=utf-8'
+            self.respond(200, body, content_type, headers)
+
+        do_HEAD = do_GET
+
+        def do_POST(self):
+            if urlsplit(self.path).path.strip('/') != 'webhook':
+                return self.respond(404, b'Not found.\n')
+            body = self.rfile.read(int(self.headers.get('Content-Length') or 0))
+            if SERVICE_WEBHOOK_SECRET:
+                expected = hmac.new(SERVICE_WEBHOOK_SECRET.encode(), body, hashlib.sha512).hexdigest()
+                if not hmac.compare_digest(expected, self.headers.get('X-Hook-Signature', '')):
+                    return self.respond(403, b'Invalid signature.\n')
+            try:
+                target = webhook_target(json.loads(body))
+            except ValueError:
+                return self.respond(400, b'Invalid JSON.\n')
+            if target is None:
+                return self.respond(204)
+            service.queue(*target)
+            self.respond(202, b'Queued.\n')
+
+    return ServiceHandler
+
+def run_service():
+    if COLLECTION_BACKEND != 'rest' or SNAPSHOT_MODE or TARGETED_COLLECTION:
+        raise ValueError("SERVICE_MODE requires the 'rest' COLLECTION_BACKEND, no SNAPSHOT_MODE and no TARGETED_COLLECTION")
+    service = GRENMLService()
+    threading.Thread(target=service.run_builds, name='grenml-builder', daemon=True).start()
+    server = ThreadingHTTPServer((SERVICE_HOST, SERVICE_PORT), make_service_handler(service))
+    print(f"Serving GRENML on http://{SERVICE_HOST}:{SERVICE_PORT}/ (NetBox webhooks: POST /webhook)")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+def main():
+    if REPORT_TRACE_MEMORY:
+        tracemalloc.start()
+    if SERVICE_MODE:
+        run_service()
+        return
+    success = False
+    try:
+        if VARIANTS:
+            success = export_variants(VARIANTS)
+            return
+        aggregation = get_aggregation()
+        data = collect_data([aggregation])
+        success = export_grenml(aggregation, data, output_path())
+    except FetchError as err:
+        # Completed pages stay checkpointed, so the next run resumes from here
+        sys.exit(f"[ERROR] {err}")
+    finally:
+        write_report(success)
+
+if __name__ == "__main__":
+    main()